@@ -1,21 +1,128 @@
 #!/usr/bin/env python3
 """
 Minimal timestamped still-image capture for Raspberry Pi Camera (Pi 5 + Cam v3).
-- Saves JPEGs into a folder
+- Saves JPEGs into a folder (staged on tmpfs, moved to the folder in the background)
 - Writes a CSV with: filename,timestamp_iso
-- Uses rpicam-still (libcamera) via subprocess for simplicity
+- Uses Picamera2 in-process (camera configured once); falls back to
+  rpicam-still via subprocess if picamera2 is not installed
 
 Usage examples
   python3 simple_timed_capture.py --out shots --interval 2 --count 50
   python3 simple_timed_capture.py --out shots   # default: interval=1s, count=10
 """
 import argparse
-import csv
+import os
+import queue
+import shutil
 import subprocess
+import threading
 import time
-from datetime import datetime
 from pathlib import Path
 
+try:
+    from picamera2 import Picamera2
+    HAS_PICAMERA2 = True
+except ImportError:
+    HAS_PICAMERA2 = False
+    Picamera2 = None
+
+FLUSH_EVERY = 50  # CSV rows between flushes; images on disk are the ground truth
+MAX_STAGED = 16  # Images waiting to be moved off tmpfs before capture blocks on the mover
+JPEG_QUALITY = 90  # Encoder quality; lower values encode faster and write smaller files
+# Images land on tmpfs (RAM) first so SD card write stalls don't delay the next shot
+DEFAULT_STAGE_DIR = "/dev/shm/shots" if os.path.isdir("/dev/shm") else ""
+
+
+def open_camera(quality=JPEG_QUALITY):
+    """Start a persistent Picamera2 still pipeline, or return None to use rpicam-still."""
+    if not HAS_PICAMERA2:
+        print("picamera2 not available, falling back to rpicam-still per shot.")
+        return None
+    cam = Picamera2()
+    cam.configure(cam.create_still_configuration())
+    # The Pi 5 has no hardware JPEG block; the ISP output is encoded on the CPU
+    # by Picamera2, so the quality setting is the main lever on encode time.
+    cam.options["quality"] = quality
+    cam.start()
+    return cam
+
+
+def capture_still(cam, path, wait=True, quality=JPEG_QUALITY):
+    """
+    Capture one JPEG to path, in-process if cam is set, else via rpicam-still.
+    With wait=False and a Picamera2 camera, returns the pending job; pass it
+    to cam.wait() before reusing the camera.
+    """
+    if cam is not None:
+        return cam.capture_file(str(path), wait=wait)
+
+    # Capture one still (requires rpicam-still in PATH)
+    # -n = no preview, -t 1 = minimal timeout, -q = JPEG quality, -o file
+    try:
+        subprocess.run([
+            "rpicam-still", "-n", "-t", "1", "-e", "jpg", "-q", str(quality), "-o", str(path)
+        ], check=True)
+    except FileNotFoundError:
+        raise SystemExit("rpicam-still not found. Install rpicam-apps: sudo apt install -y rpicam-apps")
+    return None
+
+
+def capture_burst(stage, prefix, interval, count, quality=JPEG_QUALITY):
+    """
+    Capture the whole series with one rpicam-still --timelapse run instead of
+    one process (and one libcamera pipeline start-up) per shot.
+    Returns the captured paths in order.
+    """
+    # Leftovers from an earlier burst would be picked up as this run's frames
+    for old in stage.glob(f"{prefix}_burst_*.jpg"):
+        old.unlink()
+    pattern = f"{prefix}_burst_%06d.jpg"
+    interval_ms = int(interval * 1000)
+    try:
+        subprocess.run([
+            "rpicam-still", "-n", "-e", "jpg", "-q", str(quality),
+            "--timelapse", str(interval_ms),
+            "--timeout", str(interval_ms * count + 500),
+            "--framestart", "0",
+            "-o", str(stage / pattern)
+        ], check=True)
+    except FileNotFoundError:
+        raise SystemExit("rpicam-still not found. Install rpicam-apps: sudo apt install -y rpicam-apps")
+    return sorted(stage.glob(f"{prefix}_burst_*.jpg"))[:count]
+
+
+def csv_writer(fcsv, rows):
+    """Background thread body: drain (fname, ts_iso) rows into the CSV until None arrives."""
+    n = 0
+    try:
+        while True:
+            row = rows.get()
+            if row is None:
+                break
+            fname, ts_iso = row
+            fcsv.write(f"{fname},{ts_iso}\n")
+            n += 1
+            if n % FLUSH_EVERY == 0:
+                fcsv.flush()
+    finally:
+        fcsv.flush()
+        os.fsync(fcsv.fileno())
+
+
+def file_mover(src_dir, dst_dir, names):
+    """
+    Background thread body: move finished images from the staging dir until None arrives.
+    src_dir and dst_dir are strings ending in a path separator.
+    """
+    while True:
+        fname = names.get()
+        if fname is None:
+            break
+        try:
+            shutil.move(src_dir + fname, dst_dir + fname)
+        except OSError as e:
+            print(f"[WARN] Could not move {fname} to {dst_dir}: {e}")
+
 
 def main():
     p = argparse.ArgumentParser(description="Simple interval capture with CSV log")
@@ -23,48 +130,130 @@ def main():
     p.add_argument("--interval", type=float, default=1.0, help="Seconds between shots (default 1.0)")
     p.add_argument("--count", type=int, default=10, help="How many images to capture (default 10)")
     p.add_argument("--prefix", default="img", help="Filename prefix (default 'img')")
+    p.add_argument("--stage", default=DEFAULT_STAGE_DIR,
+                   help=f"Staging directory on tmpfs ('' to write straight to --out; default '{DEFAULT_STAGE_DIR}')")
+    p.add_argument("--burst", action="store_true",
+                   help="Without picamera2, capture the series with one rpicam-still --timelapse run "
+                        "instead of one process per shot; timestamps are then file write times, "
+                        "not trigger times")
+    p.add_argument("--quality", type=int, default=JPEG_QUALITY, help=f"JPEG quality 1-100 (default {JPEG_QUALITY})")
     args = p.parse_args()
 
     outdir: Path = args.out
     outdir.mkdir(parents=True, exist_ok=True)
     csv_path = outdir / "shots.csv"
 
-    # Open CSV and write header
-    with csv_path.open("w", newline="") as fcsv:
-        writer = csv.writer(fcsv)
-        writer.writerow(["filename", "timestamp_iso"])  # header
+    # Capture into the staging dir; a mover thread drains it to outdir
+    stage = Path(args.stage) if args.stage else outdir
+    if stage.resolve() == outdir.resolve():
+        stage = outdir
+    else:
+        stage.mkdir(parents=True, exist_ok=True)
+
+    # Configure the camera once, outside the capture loop
+    cam = open_camera(args.quality)
 
-        print(f"Saving {args.count} images to {outdir.resolve()} (every {args.interval}s)")
+    # Open CSV and write header (fields never contain commas or quotes,
+    # so rows are written directly without csv.writer)
+    try:
+        with csv_path.open("w", newline="", buffering=8192) as fcsv:
+            fcsv.write("filename,timestamp_iso\n")  # header
 
-        # Use monotonic scheduling to avoid drift
-        t_next = time.monotonic()
-        for i in range(args.count):
-            t_next += args.interval
+            print(f"Saving {args.count} images to {outdir.resolve()} (every {args.interval}s)")
 
-            # Timestamp for filename and CSV
-            now = datetime.now()
-            ts_iso = now.isoformat(timespec="milliseconds")
-            fname = f"{args.prefix}_{now.strftime('%Y%m%d_%H%M%S_%f')[:-3]}.jpg"
-            path = outdir / fname
+            # CSV logging runs on its own thread so it overlaps the next capture
+            rows = queue.Queue(maxsize=8)
+            writer = threading.Thread(target=csv_writer, args=(fcsv, rows), daemon=True)
+            writer.start()
+            pending = None
+
+            moves = None
+            if stage is not outdir:
+                # Bounded so a slow SD card makes capture wait instead of filling RAM
+                moves = queue.Queue(maxsize=MAX_STAGED)
+                mover = threading.Thread(target=file_mover, daemon=True,
+                                         args=(str(stage.resolve()) + os.sep, str(outdir.resolve()) + os.sep, moves))
+                mover.start()
+            staged = None  # last image whose capture may still be in flight
 
-            # Capture one still (requires rpicam-still in PATH)
-            # -n = no preview, -t 1 = minimal timeout, -o file
             try:
-                subprocess.run([
-                    "rpicam-still", "-n", "-t", "1", "-o", str(path)
-                ], check=True)
-            except FileNotFoundError:
-                raise SystemExit("rpicam-still not found. Install rpicam-apps: sudo apt install -y rpicam-apps")
-
-            # Log to CSV
-            writer.writerow([fname, ts_iso])
-            fcsv.flush()
-            print(f"[{i+1}/{args.count}] -> {fname} @ {ts_iso}")
-
-            # Sleep until next tick (avoid negative)
-            remaining = t_next - time.monotonic()
-            if remaining > 0:
-                time.sleep(remaining)
+                # Plain string concat in the loop instead of a Path join per shot
+                stage_str = str(stage.resolve()) + os.sep
+
+                # Second-granular date strings only change once per second, so they are cached
+                last_sec = None
+                iso_base = fname_base = ""
+
+                # With --burst and no picamera2, one rpicam-still process captures the whole series.
+                # Timestamps then come from each file's mtime (written just after capture).
+                burst = cam is None and args.count > 1 and args.burst
+                if burst:
+                    shots = capture_burst(stage, args.prefix, args.interval, args.count, args.quality)
+                    for i, src in enumerate(shots):
+                        sec, ns = divmod(src.stat().st_mtime_ns, 1_000_000_000)
+                        lt = time.localtime(sec)
+                        ms = ns // 1_000_000
+                        ts_iso = f"{time.strftime('%Y-%m-%dT%H:%M:%S', lt)}.{ms:03d}"
+                        fname = f"{args.prefix}_{time.strftime('%Y%m%d_%H%M%S', lt)}_{ms:03d}.jpg"
+                        src.rename(stage / fname)
+                        if moves is not None:
+                            moves.put(fname)
+                        rows.put((fname, ts_iso))
+                        print(f"[{i+1}/{args.count}] -> {fname} @ {ts_iso}")
+
+                # Use monotonic scheduling to avoid drift
+                t_next = time.monotonic()
+                for i in range(0 if burst else args.count):
+                    t_next += args.interval
+
+                    # Timestamp for filename and CSV (one clock read per tick)
+                    sec, ns = divmod(time.time_ns(), 1_000_000_000)
+                    if sec != last_sec:
+                        lt = time.localtime(sec)
+                        iso_base = time.strftime("%Y-%m-%dT%H:%M:%S", lt)
+                        fname_base = time.strftime("%Y%m%d_%H%M%S", lt)
+                        last_sec = sec
+                    ms = ns // 1_000_000
+                    ts_iso = f"{iso_base}.{ms:03d}"
+                    fname = f"{args.prefix}_{fname_base}_{ms:03d}.jpg"
+                    path = stage_str + fname
+
+                    # Finish the previous capture before triggering the next one
+                    if pending is not None:
+                        cam.wait(pending)
+                        pending = None
+                    if moves is not None and staged is not None:
+                        moves.put(staged)
+                    staged = fname
+                    pending = capture_still(cam, path, wait=False, quality=args.quality)
+
+                    # Log to CSV (handed off to the writer thread)
+                    rows.put((fname, ts_iso))
+                    print(f"[{i+1}/{args.count}] -> {fname} @ {ts_iso}")
+
+                    # Sleep until next tick (avoid negative)
+                    remaining = t_next - time.monotonic()
+                    if remaining > 0:
+                        time.sleep(remaining)
+            finally:
+                # Also runs on Ctrl+C or a failed capture: finish the in-flight shot,
+                # then drain the CSV rows and staged images before leaving
+                try:
+                    if pending is not None:
+                        cam.wait(pending)
+                finally:
+                    rows.put(None)
+                    writer.join()
+                    if moves is not None:
+                        if staged is not None:
+                            moves.put(staged)
+                        moves.put(None)
+                        print("Moving staged images to output directory...")
+                        mover.join()
+    finally:
+        if cam is not None:
+            cam.stop()
+            cam.close()
 
     print(f"Done. Wrote CSV: {csv_path}")
 
@@ -3,7 +3,7 @@
 check_setup.py
 
 Combined capture script for:
-- Camera (still images via rpicam-still)
+- Camera (still images via Picamera2, or rpicam-still as a fallback, on a capture thread)
 - IMU (BNO055 over I2C)
 - UWB (NXP script output parsed from stdout)
 
@@ -21,18 +21,23 @@ Usage example:
     python3 check_setup.py --out run1 --interval 0.2 --count 300 --prefix frame
 
 Dependencies:
-    - rpicam-apps (for rpicam-still)
-    - Adafruit_BNO055 + Blinka stack for IMU
+    - picamera2 (preferred) or rpicam-apps (for rpicam-still)
+    - Adafruit_BNO055 + Blinka stack for IMU (smbus2 optional, for faster reads)
     - Your nxp.py UWB script in the same directory (or adjust UWB_COMMAND)
 """
 
 import argparse
-import csv
+import queue
 import subprocess
 import time
 import threading
+import os
 import re
-from datetime import datetime
+import selectors
+import shutil
+import signal
+import struct
+from collections import namedtuple
 from pathlib import Path
 
 # ------------------ IMU IMPORTS (LAZY-FRIENDLY) ------------------ #
@@ -46,8 +51,37 @@ except ImportError as e:
     HAS_IMU_LIBS = False
     board = busio = adafruit_bno055 = None
 
+# Optional raw I2C client: skips the Blinka/bus_device layers for per-frame reads
+try:
+    from smbus2 import SMBus, i2c_msg
+    HAS_SMBUS2 = True
+except ImportError:
+    HAS_SMBUS2 = False
+    SMBus = i2c_msg = None
+
+# ------------------ CAMERA IMPORTS (LAZY-FRIENDLY) ------------------ #
+try:
+    from picamera2 import Picamera2
+    HAS_PICAMERA2 = True
+except ImportError:
+    HAS_PICAMERA2 = False
+    Picamera2 = None
+
 # ------------------ IMU CONFIG ------------------ #
 IMU_I2C_ADDRESS = 0x28  # Change to 0x29 if needed
+IMU_I2C_BUS = 1         # /dev/i2c-1 (GPIO 2/3); used by the smbus2 fast path
+
+# BNO055 page-0 registers. Euler heading/roll/pitch are contiguous int16s
+# (1/16 degree per LSB); TEMP and CALIB_STAT are adjacent bytes.
+IMU_REG_EULER = bytes([0x1A])
+IMU_REG_TEMP = bytes([0x34])
+IMU_EULER_SCALE = 1.0 / 16.0
+IMU_EULER_STRUCT = struct.Struct("<hhh")  # heading, roll, pitch
+IMU_STATUS_STRUCT = struct.Struct("<bB")  # temperature, calibration status
+
+# Order of the values returned by read_imu()
+IMU_FIELDS = ("temp", "heading", "roll", "pitch", "sys_cal", "gyro_cal", "accel_cal", "mag_cal")
+IMU_EMPTY = (None,) * len(IMU_FIELDS)  # Shared "no sample" value
 
 
 def get_imu_sensor():
@@ -57,6 +91,20 @@ def get_imu_sensor():
     try:
         i2c = busio.I2C(board.SCL, board.SDA)
         sensor = adafruit_bno055.BNO055_I2C(i2c, address=IMU_I2C_ADDRESS)
+        # Reusable scratch buffers for read_imu() (no allocation per sample)
+        sensor._euler_buf = bytearray(IMU_EULER_STRUCT.size)
+        sensor._status_buf = bytearray(IMU_STATUS_STRUCT.size)
+        # The Adafruit driver still does mode setup; per-frame reads go
+        # straight to /dev/i2c-N when smbus2 is available.
+        sensor._bus = None
+        if HAS_SMBUS2:
+            sensor._bus = SMBus(IMU_I2C_BUS)
+            sensor._msgs = (
+                i2c_msg.write(IMU_I2C_ADDRESS, IMU_REG_EULER),
+                i2c_msg.read(IMU_I2C_ADDRESS, IMU_EULER_STRUCT.size),
+                i2c_msg.write(IMU_I2C_ADDRESS, IMU_REG_TEMP),
+                i2c_msg.read(IMU_I2C_ADDRESS, IMU_STATUS_STRUCT.size),
+            )
         print("IMU: BNO055 connected.")
         return sensor
     except Exception as e:
@@ -69,63 +117,94 @@ def get_imu_sensor():
 def read_imu(sensor):
     """
     Read one IMU sample.
-    Returns a dict:
-        {
-            "temp": float or None,
-            "heading": float or None,
-            "roll": float or None,
-            "pitch": float or None,
-            "sys_cal": int or None,
-            "gyro_cal": int or None,
-            "accel_cal": int or None,
-            "mag_cal": int or None,
-        }
-    If sensor is None or reading fails, all fields are None.
+    Returns a tuple in CSV column order (see IMU_FIELDS):
+        (temp, heading, roll, pitch, sys_cal, gyro_cal, accel_cal, mag_cal)
+    so it can be spliced straight into a row without building a dict.
+    If sensor is None or reading fails, returns the shared IMU_EMPTY tuple.
     """
-    empty = {
-        "temp": None,
-        "heading": None,
-        "roll": None,
-        "pitch": None,
-        "sys_cal": None,
-        "gyro_cal": None,
-        "accel_cal": None,
-        "mag_cal": None,
-    }
     if sensor is None:
-        return empty
+        return IMU_EMPTY
 
     try:
-        temp = sensor.temperature
-        euler = sensor.euler  # (heading, roll, pitch) or None
-        if euler:
-            h, r, p = euler
+        # Two burst reads instead of one transaction per register/property
+        if sensor._bus is not None:
+            # Both reads in a single I2C_RDWR ioctl
+            msgs = sensor._msgs
+            sensor._bus.i2c_rdwr(*msgs)
+            euler_buf = bytes(msgs[1])
+            status_buf = bytes(msgs[3])
         else:
-            h, r, p = (None, None, None)
-        cal_sys, cal_gyro, cal_accel, cal_mag = sensor.calibration_status
-        return {
-            "temp": temp,
-            "heading": h,
-            "roll": r,
-            "pitch": p,
-            "sys_cal": cal_sys,
-            "gyro_cal": cal_gyro,
-            "accel_cal": cal_accel,
-            "mag_cal": cal_mag,
-        }
+            euler_buf = sensor._euler_buf
+            status_buf = sensor._status_buf
+            with sensor.i2c_device as dev:
+                read = dev.write_then_readinto
+                read(IMU_REG_EULER, euler_buf)
+                read(IMU_REG_TEMP, status_buf)
+        h, r, p = IMU_EULER_STRUCT.unpack_from(euler_buf)
+        temp, cal = IMU_STATUS_STRUCT.unpack_from(status_buf)
+        return (
+            temp,
+            h * IMU_EULER_SCALE,
+            r * IMU_EULER_SCALE,
+            p * IMU_EULER_SCALE,
+            (cal >> 6) & 0x03,
+            (cal >> 4) & 0x03,
+            (cal >> 2) & 0x03,
+            cal & 0x03,
+        )
     except Exception as e:
         print("IMU read error:", e)
-        return empty
+        return IMU_EMPTY
+
+
+# ------------------ CPU PINNING ------------------ #
+# Keep the stages off each other's cores (4-core Pi 5). Pinning and SCHED_FIFO
+# need root or CAP_SYS_NICE; without them a warning is printed and the run
+# continues with normal scheduling.
+CPU_CAMERA = 0
+CPU_UWB = 1
+CPU_MAIN = 2
+MAIN_RT_PRIORITY = 20  # SCHED_FIFO priority for the capture loop; None to disable
+
+
+def pin_to_cpu(cpu, who, pid=0):
+    """Pin a process, or the calling thread when pid is 0, to one core."""
+    try:
+        os.sched_setaffinity(pid, {cpu})
+    except (AttributeError, OSError) as e:
+        print(f"WARNING: Could not pin {who} to CPU {cpu}: {e}")
+
+
+def set_main_realtime():
+    """Pin the capture loop to CPU_MAIN and raise it to SCHED_FIFO."""
+    pin_to_cpu(CPU_MAIN, "main loop")
+    if MAIN_RT_PRIORITY is None:
+        return
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(MAIN_RT_PRIORITY))
+    except (AttributeError, OSError) as e:
+        print(f"WARNING: Could not enable SCHED_FIFO (run with sudo for lower jitter): {e}")
 
 
 # ------------------ UWB CONFIG ------------------ #
 # This should match the command you use to run your UWB script.
 # Adjust as needed (device path, args, etc.).
 UWB_COMMAND = ["python", "-u", "nxp.py", "i", "100", "/dev/ttyUSB0"]
+UWB_READ_SIZE = 4096  # Max bytes drained from the pipe per read
+UWB_POLL_SEC = 0.1    # select() timeout; bounds how long stop() takes
+
+# One parsed UWB reading, in CSV column order. timestamp is epoch ns (int).
+UWBSample = namedtuple(
+    "UWBSample", "timestamp distance_cm azimuth_deg elevation_deg nlos_status"
+)
+UWB_EMPTY = UWBSample(None, None, None, None, None)
 
-# Regex to extract NLoS, distance, azimuth, elevation from nxp.py output
+# Regex to extract NLoS, distance, azimuth, elevation from nxp.py output:
+#   ***(n) NLos:0   Dist:250   Azimuth:-12.5 (FOM:93)   Elevation:5.0 (FOM:80) ...
+# Fields are separated by explicit whitespace/FOM tokens instead of greedy
+# ".*" spans, so matching never backtracks over the rest of the line.
 UWB_PATTERN = re.compile(
-    r"NLos:(\d+).*Dist:(\d+).*Azimuth:([-\d\.]+).*Elevation:([-\d\.]+)"
+    r"NLos:(\d+)\s+Dist:(\d+)\s+Azimuth:([-\d.]+)\s+\(FOM:\d+\)\s+Elevation:([-\d.]+)"
 )
 
 
@@ -137,82 +216,190 @@ class UWBReader(threading.Thread):
 
     def __init__(self):
         super().__init__(daemon=True)
-        self.latest = None  # dict or None
-        self.lock = threading.Lock()
+        # Latest UWBSample or None. Single producer (this thread), single
+        # consumer: each reading is a new immutable tuple published with one
+        # attribute store, which is atomic under the GIL, so no lock is needed.
+        self.latest = None
         self._stop_event = threading.Event()
         self.process = None
 
     def run(self):
+        # The nxp.py subprocess inherits this thread's core
+        pin_to_cpu(CPU_UWB, "UWB thread")
         print("Starting UWB subprocess:", " ".join(UWB_COMMAND))
         try:
             self.process = subprocess.Popen(
                 UWB_COMMAND,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
+                bufsize=0,
             )
         except Exception as e:
             print("ERROR: Could not start UWB process:", e)
             return
 
+        # Drain whatever the pipe holds in one os.read() instead of one
+        # readline() per line; select() with a timeout is the only wait, so
+        # stop() takes effect within UWB_POLL_SEC.
+        fd = self.process.stdout.fileno()
+        sel = selectors.DefaultSelector()
+        sel.register(fd, selectors.EVENT_READ)
+        pending = b""
         try:
             while not self._stop_event.is_set():
-                line = self.process.stdout.readline()
-                if not line and self.process.poll() is not None:
-                    # Process ended
+                if not sel.select(timeout=UWB_POLL_SEC):
+                    continue
+                data = os.read(fd, UWB_READ_SIZE)
+                if not data:
+                    # EOF: process ended
+                    self.process.wait()
                     print("UWB subprocess has stopped.")
                     err = self.process.stderr.read()
                     if err:
-                        print("UWB error details:\n", err)
+                        print("UWB error details:\n", err.decode(errors="replace"))
                     break
 
-                if not line:
-                    # No data; small sleep to avoid tight loop
-                    time.sleep(0.01)
-                    continue
-
-                line = line.strip()
-                # Optional: print raw line for debugging
-                # print("[UWB]", line)
-
-                m = UWB_PATTERN.search(line)
-                if m:
-                    timestamp = datetime.now().strftime("%H:%M:%S.%f")
-                    nlos = m.group(1)
-                    dist = m.group(2)
-                    azimuth = m.group(3)
-                    elevation = m.group(4)
-                    with self.lock:
-                        self.latest = {
-                            "timestamp": timestamp,
-                            "distance_cm": dist,
-                            "azimuth_deg": azimuth,
-                            "elevation_deg": elevation,
-                            "nlos_status": nlos,
-                        }
+                *lines, pending = (pending + data).split(b"\n")
+                for raw in lines:
+                    self._parse_line(raw.decode("ascii", errors="replace"))
         finally:
+            sel.close()
             if self.process is not None and self.process.poll() is None:
                 self.process.terminate()
             print("UWBReader thread exiting.")
 
+    def _parse_line(self, line):
+        """Parse one line of nxp.py output and publish it if it is a ranging result."""
+        # Optional: print raw line for debugging
+        # print("[UWB]", line.strip())
+
+        m = UWB_PATTERN.search(line)
+        if m:
+            # Convert once here; the timestamp stays an int (epoch ns) and is
+            # only formatted when the CSV row is written.
+            nlos, dist, azimuth, elevation = m.groups()
+            self.latest = UWBSample(
+                time.time_ns(), int(dist), float(azimuth), float(elevation), int(nlos)
+            )
+
     def stop(self):
         self._stop_event.set()
 
     def get_latest(self):
-        """Return a shallow copy of the latest UWB reading or None."""
-        with self.lock:
-            if self.latest is None:
-                return None
-            return dict(self.latest)
+        """Return the latest UWBSample (immutable, no copy needed) or None."""
+        return self.latest
 
 
 # ------------------ CAMERA CAPTURE ------------------ #
-def capture_frame(out_path: Path):
+RPICAM_WAIT_SEC = 5.0    # Give up on a signalled rpicam-still frame after this long
+RPICAM_POLL_SEC = 0.005  # --latest link polling interval while waiting for a frame
+
+
+class RpicamSignalCamera:
+    """
+    One long-running `rpicam-still -t 0 --signal` process for the whole run:
+    each SIGUSR1 captures a frame, so libcamera starts up once instead of per
+    frame. Mimics the bits of the Picamera2 API that capture_frame() uses.
+
+    rpicam-still repoints the --latest symlink only after a frame is fully
+    saved, so the link both names the newest numbered file and says it is
+    complete; no frame index is tracked on this side.
+    """
+
+    def __init__(self, outdir: Path):
+        outdir = outdir.resolve()
+        self.pattern = str(outdir / "rpicam_%05d.jpg")
+        self.latest = str(outdir / "rpicam_latest.jpg")
+        self.last_src = None  # last frame handed to capture_file's caller
+        try:
+            os.unlink(self.latest)  # stale link from an earlier run
+        except FileNotFoundError:
+            pass
+        self.process = subprocess.Popen(
+            ["rpicam-still", "-n", "-t", "0", "--signal",
+             "-o", self.pattern, "--latest", self.latest],
+            stdout=subprocess.DEVNULL,
+        )
+        pin_to_cpu(CPU_CAMERA, "rpicam-still", self.process.pid)
+
+    def _newest(self):
+        """Path of the newest complete frame, or None before the first one."""
+        try:
+            return os.readlink(self.latest)
+        except FileNotFoundError:
+            return None
+
+    def capture_file(self, out_path):
+        """Trigger one capture and move the resulting frame to out_path."""
+        before = self._newest()
+        if before is not None and before != self.last_src:
+            # Late frame from a capture that already timed out; never hand it out
+            try:
+                os.remove(before)
+            except FileNotFoundError:
+                pass
+        self.process.send_signal(signal.SIGUSR1)
+
+        deadline = time.monotonic() + RPICAM_WAIT_SEC
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("rpicam-still exited")
+            src = self._newest()
+            if src is not None and src != before:
+                os.replace(src, out_path)
+                self.last_src = src
+                return
+            time.sleep(RPICAM_POLL_SEC)
+        raise TimeoutError(f"no frame from rpicam-still after {RPICAM_WAIT_SEC}s")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGUSR2)  # asks rpicam-still to quit
+            try:
+                self.process.wait(timeout=2.0)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
+
+    def close(self):
+        pass
+
+
+def open_camera(outdir: Path):
     """
-    Capture one JPEG still using rpicam-still.
-    Raises SystemExit if rpicam-still is missing.
+    Start a persistent camera for the run (configured once): Picamera2 if
+    available, else a single signal-driven rpicam-still process.
+    Returns None if neither is available, so rpicam-still is run per frame.
     """
+    if not HAS_PICAMERA2:
+        if shutil.which("rpicam-still") is None:
+            print("picamera2 and rpicam-still not available.")
+            return None
+        print("picamera2 not available, using one rpicam-still --signal process.")
+        return RpicamSignalCamera(outdir)
+    try:
+        cam = Picamera2()
+        cam.configure(cam.create_still_configuration())
+        cam.start()
+        print("Camera: Picamera2 started.")
+        return cam
+    except Exception as e:
+        print("Camera ERROR: Could not start Picamera2, falling back to rpicam-still:", e)
+        return None
+
+
+def capture_frame(out_path, cam=None):
+    """
+    Capture one JPEG still with cam (Picamera2 or RpicamSignalCamera) if
+    given, otherwise by running rpicam-still for this frame.
+    Raises SystemExit if rpicam-still is needed but missing.
+    """
+    if cam is not None:
+        try:
+            cam.capture_file(str(out_path))
+        except Exception as e:
+            print("Camera capture error:", e)
+        return
+
     try:
         subprocess.run(
             ["rpicam-still", "-n", "-t", "1", "-o", str(out_path)],
@@ -227,6 +414,90 @@ def capture_frame(out_path: Path):
         print("Camera capture error:", e)
 
 
+def camera_worker(jobs, cam):
+    """Camera stage: capture each queued image path until None arrives."""
+    # Per-frame rpicam-still processes inherit this thread's core
+    pin_to_cpu(CPU_CAMERA, "camera thread")
+    while True:
+        out_path = jobs.get()
+        if out_path is None:
+            break
+        capture_frame(out_path, cam)
+
+
+# ------------------ CSV CONFIG ------------------ #
+CSV_COLUMNS = (
+    "frame_index",
+    "image_filename",
+    "frame_ts_iso",
+    # IMU fields
+    "imu_temp_C",
+    "imu_heading_deg",
+    "imu_roll_deg",
+    "imu_pitch_deg",
+    "imu_sys_cal",
+    "imu_gyro_cal",
+    "imu_accel_cal",
+    "imu_mag_cal",
+    # UWB fields
+    "uwb_sample_ts",
+    "uwb_distance_cm",
+    "uwb_azimuth_deg",
+    "uwb_elevation_deg",
+    "uwb_nlos_status",
+)
+# The schema is fixed and no field can contain a comma or quote (the prefix
+# is checked in main), so rows are formatted directly instead of via csv.writer.
+CSV_ROW_FMT = ",".join(["{}"] * len(CSV_COLUMNS)) + "\n"
+CSV_BATCH_ROWS = 16   # Rows buffered before one writerows() + flush()
+CSV_BATCH_SEC = 0.5   # ...or flush sooner if this much time has passed
+UWB_TS_COL = 3 + len(IMU_FIELDS)  # Row index of uwb_sample_ts
+
+
+def format_clock_ns(ns):
+    """Format epoch nanoseconds as local HH:MM:SS.ffffff."""
+    sec, ns = divmod(ns, 1_000_000_000)
+    return f"{time.strftime('%H:%M:%S', time.localtime(sec))}.{ns // 1000:06d}"
+
+
+def csv_worker(fcsv, rows):
+    """
+    CSV stage: drain row tuples from the queue until None arrives, writing
+    them in batches of CSV_BATCH_ROWS or every CSV_BATCH_SEC.
+    """
+    fmt = CSV_ROW_FMT.format
+    row_buf = []
+    last_flush = time.monotonic()
+    try:
+        while True:
+            try:
+                row = rows.get(timeout=CSV_BATCH_SEC)
+            except queue.Empty:
+                row = ()
+            if row is None:
+                break
+            if row:
+                # Missing sensor values are written as empty fields
+                row = ["" if v is None else v for v in row]
+                ts = row[UWB_TS_COL]
+                if ts != "":
+                    row[UWB_TS_COL] = format_clock_ns(ts)
+                row_buf.append(fmt(*row))
+            if row_buf and (len(row_buf) >= CSV_BATCH_ROWS
+                            or time.monotonic() - last_flush >= CSV_BATCH_SEC):
+                fcsv.write("".join(row_buf))
+                row_buf.clear()
+                fcsv.flush()
+                last_flush = time.monotonic()
+    finally:
+        fcsv.write("".join(row_buf))
+        fcsv.flush()
+
+
+# ------------------ OUTPUT CONFIG ------------------ #
+FRAMES_PER_DIR = 1000  # Images per subdirectory when --count exceeds this
+
+
 # ------------------ MAIN LOOP ------------------ #
 def main():
     parser = argparse.ArgumentParser(
@@ -257,16 +528,32 @@ def main():
     )
 
     args = parser.parse_args()
+    if any(c in args.prefix for c in ',"\r\n'):
+        parser.error("--prefix must not contain commas, quotes or newlines")
     outdir: Path = args.out
     outdir.mkdir(parents=True, exist_ok=True)
 
     csv_path = outdir / "combined_log.csv"
 
+    # Long runs are split into subdirectories of FRAMES_PER_DIR images so no
+    # single directory grows huge. Directories and their path prefixes are
+    # created once up front; the loop only concatenates strings.
+    outdir_str = str(outdir) + os.sep
+    if args.count > FRAMES_PER_DIR:
+        subdirs = [f"{d:04d}{os.sep}" for d in range((args.count - 1) // FRAMES_PER_DIR + 1)]
+        for sub in subdirs:
+            os.makedirs(outdir_str + sub, exist_ok=True)
+    else:
+        subdirs = [""]
+
     # Init IMU
     imu_sensor = get_imu_sensor()
     if imu_sensor is None:
         print("IMU disabled: will log empty IMU fields.")
 
+    # Init camera (once, outside the capture loop)
+    cam = open_camera(outdir)
+
     # Init UWB reader
     uwb_reader = UWBReader()
     uwb_reader.start()
@@ -274,97 +561,91 @@ def main():
 
     # Prepare CSV
     with csv_path.open("w", newline="") as fcsv:
-        writer = csv.writer(fcsv)
-
         # Header
-        writer.writerow(
-            [
-                "frame_index",
-                "image_filename",
-                "frame_ts_iso",
-                # IMU fields
-                "imu_temp_C",
-                "imu_heading_deg",
-                "imu_roll_deg",
-                "imu_pitch_deg",
-                "imu_sys_cal",
-                "imu_gyro_cal",
-                "imu_accel_cal",
-                "imu_mag_cal",
-                # UWB fields
-                "uwb_sample_ts",
-                "uwb_distance_cm",
-                "uwb_azimuth_deg",
-                "uwb_elevation_deg",
-                "uwb_nlos_status",
-            ]
-        )
+        fcsv.write(",".join(CSV_COLUMNS) + "\n")
 
         print(
             f"Capturing {args.count} frames to {outdir.resolve()} "
             f"(every {args.interval}s)"
         )
 
-        t_next = time.monotonic()
-        for i in range(args.count):
-            t_next += args.interval
-
-            # Timestamp for this frame
-            now = datetime.now()
-            frame_ts_iso = now.isoformat(timespec="milliseconds")
-            fname = f"{args.prefix}_{now.strftime('%Y%m%d_%H%M%S_%f')[:-3]}.jpg"
-            img_path = outdir / fname
-
-            # --- Capture image ---
-            capture_frame(img_path)
-
-            # --- Read IMU (if available) ---
-            imu_data = read_imu(imu_sensor)
-
-            # --- Grab latest UWB sample (if any) ---
-            uwb_sample = uwb_reader.get_latest() or {
-                "timestamp": None,
-                "distance_cm": None,
-                "azimuth_deg": None,
-                "elevation_deg": None,
-                "nlos_status": None,
-            }
-
-            # --- Write CSV row ---
-            writer.writerow(
-                [
-                    i,
-                    fname,
-                    frame_ts_iso,
-                    # IMU
-                    imu_data["temp"],
-                    imu_data["heading"],
-                    imu_data["roll"],
-                    imu_data["pitch"],
-                    imu_data["sys_cal"],
-                    imu_data["gyro_cal"],
-                    imu_data["accel_cal"],
-                    imu_data["mag_cal"],
-                    # UWB
-                    uwb_sample["timestamp"],
-                    uwb_sample["distance_cm"],
-                    uwb_sample["azimuth_deg"],
-                    uwb_sample["elevation_deg"],
-                    uwb_sample["nlos_status"],
-                ]
-            )
-            fcsv.flush()
-
-            print(
-                f"[{i+1}/{args.count}] {fname} @ {frame_ts_iso} | "
-                f"IMU: H={imu_data['heading']} R={imu_data['roll']} P={imu_data['pitch']} | "
-                f"UWB dist={uwb_sample['distance_cm']}cm"
-            )
+        # Pipeline: camera capture and CSV writing run on their own threads,
+        # so a frame costs max(stage) instead of the sum of all stages.
+        # At most one capture may wait behind the running one: the row's
+        # timestamp, IMU and UWB are read when the job is queued, so a deeper
+        # queue would let the picture drift frames away from its CSV row.
+        jobs = queue.Queue(maxsize=1)
+        rows = queue.Queue(maxsize=64)
+        cam_thread = threading.Thread(target=camera_worker, args=(jobs, cam), daemon=True)
+        csv_thread = threading.Thread(target=csv_worker, args=(fcsv, rows), daemon=True)
+        cam_thread.start()
+        csv_thread.start()
+
+        # Only now: threads and subprocesses started after this would
+        # inherit the main loop's core and real-time priority.
+        set_main_realtime()
 
-            # Wait for next frame time
-            remaining = t_next - time.monotonic()
-            if remaining > 0:
-                time.sleep(remaining)
+        try:
+            # Second-granular date strings only change once per second, so they are cached
+            last_sec = None
+            iso_base = fname_base = ""
+
+            t_next = time.monotonic()
+            for i in range(args.count):
+                t_next += args.interval
+
+                # Timestamp for this frame (one clock read, no datetime objects)
+                sec, ns = divmod(time.time_ns(), 1_000_000_000)
+                if sec != last_sec:
+                    lt = time.localtime(sec)
+                    iso_base = time.strftime("%Y-%m-%dT%H:%M:%S", lt)
+                    fname_base = time.strftime("%Y%m%d_%H%M%S", lt)
+                    last_sec = sec
+                ms = ns // 1_000_000
+                frame_ts_iso = f"{iso_base}.{ms:03d}"
+                fname = subdirs[i // FRAMES_PER_DIR] + f"{args.prefix}_{fname_base}_{ms:03d}.jpg"
+                img_path = outdir_str + fname
+
+                # --- Capture image (camera thread) ---
+                jobs.put(img_path)
+
+                # --- Read IMU (if available) ---
+                imu_data = read_imu(imu_sensor)
+
+                # --- Grab latest UWB sample (if any) ---
+                uwb_sample = uwb_reader.get_latest() or UWB_EMPTY
+
+                # --- Queue CSV row (CSV thread writes in batches) ---
+                rows.put(
+                    (i, fname, frame_ts_iso) + imu_data + uwb_sample
+                )
+
+                print(
+                    f"[{i+1}/{args.count}] {fname} @ {frame_ts_iso} | "
+                    f"IMU: H={imu_data[1]} R={imu_data[2]} P={imu_data[3]} | "
+                    f"UWB dist={uwb_sample.distance_cm}cm"
+                )
+
+                # Wait for next frame time. If we overran by more than a whole
+                # interval, skip the missed slots instead of firing a burst of
+                # back-to-back frames to catch up (--interval 0 = as fast as possible).
+                remaining = t_next - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+                elif args.interval > 0 and remaining < -args.interval:
+                    missed = int(-remaining // args.interval)
+                    t_next += missed * args.interval
+                    print(f"WARNING: frame {i} overran, skipped {missed} slot(s)")
+        finally:
+            # Also runs on Ctrl+C: finish queued captures, then write out every row
+            jobs.put(None)
+            cam_thread.join()
+            rows.put(None)
+            csv_thread.join()
+
+    if cam is not None:
+        cam.stop()
+        cam.close()
 
     # Stop UWB reader
     uwb_reader.stop()
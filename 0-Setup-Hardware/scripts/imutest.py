@@ -1,12 +1,94 @@
+import io
+import os
 import time
+import struct
 import board
 import busio
-import csv
 import adafruit_bno055
 
 # --- CONFIGURATION ---
 OUTPUT_FILE = "imu_data.csv"
 I2C_ADDRESS = 0x28  # Change to 0x29 if you get a connection error
+SAMPLE_RATE_HZ = 5  # Needs i2c_arm_baudrate=400000 for rates above ~20 Hz
+FLUSH_EVERY = 200   # Rows between flushes (bounds data lost on a crash)
+PRINT_INTERVAL = 1.0  # Seconds between console lines (every sample is still logged)
+RT_CPU = 3          # Core to pin the logger to (pair with isolcpus=3 on the kernel cmdline)
+RT_PRIORITY = 50    # SCHED_FIFO priority (needs root or CAP_SYS_NICE); None to disable
+CAL_INTERVAL = 1.0  # Seconds between temperature/calibration reads (both change slowly)
+RETRY_WAIT = 0.001  # Seconds before re-trying a failed I2C read (clock-stretch glitches are brief)
+
+# CSV layout. No field can contain a comma or quote, so rows are formatted
+# directly instead of going through csv.writer.
+CSV_HEADER = "Timestamp,Temp_C,Heading,Roll,Pitch,Sys_Cal,Gyro_Cal,Accel_Cal,Mag_Cal\n"
+ROW_FMT = "%s,%d,%.4f,%.4f,%.4f,%d,%d,%d,%d\n"
+PRINT_FMT = "[%s] Temp: %d°C | H: %.2f R: %.2f P: %.2f | Cal: (%d, %d, %d, %d)"
+
+# --- BNO055 REGISTER MAP (page 0) ---
+# Euler angles (0x1A..0x1F) are read every sample; TEMP (0x34) and
+# CALIB_STAT (0x35) are adjacent, so both come from one short read that is
+# only repeated every CAL_INTERVAL.
+REG_EUL_HEADING_LSB = 0x1A
+REG_TEMP = 0x34
+REG_CALIB_STAT = 0x35
+
+EULER_STRUCT = struct.Struct("<hhh")  # heading, roll, pitch (int16)
+STATUS_STRUCT = struct.Struct("<bB")  # temperature (int8), calibration status (uint8)
+EULER_SCALE = 1.0 / 16.0  # Euler angles are 1/16 degree per LSB
+
+
+class BNO055Block:
+    """
+    Reads one IMU sample with a single I2C transaction instead of one per property.
+    Temperature and calibration status are cached and refreshed every CAL_INTERVAL.
+    """
+
+    def __init__(self, sensor):
+        # Talk to the I2C device directly, bypassing adafruit_bno055's properties
+        self.device = sensor.i2c_device
+        self.euler_reg = bytes([REG_EUL_HEADING_LSB])
+        self.euler_buf = bytearray(EULER_STRUCT.size)
+        self.unpack_euler = EULER_STRUCT.unpack_from
+        self.status_reg = bytes([REG_TEMP])
+        self.status_buf = bytearray(STATUS_STRUCT.size)
+        self.unpack_status = STATUS_STRUCT.unpack_from
+        self.status = (0, 0, 0, 0, 0)  # temp, sys, gyro, accel, mag
+        self.next_status = 0.0
+        self.retries = 0  # Reads that needed a second attempt (many => baudrate too high)
+
+    def read_into(self, row):
+        """
+        Fills row[1:9] in place with
+        (temp, heading, roll, pitch, sys_cal, gyro_cal, accel_cal, mag_cal).
+        """
+        now = time.monotonic()
+        with self.device as dev:
+            dev.write_then_readinto(self.euler_reg, self.euler_buf)
+            if now >= self.next_status:
+                dev.write_then_readinto(self.status_reg, self.status_buf)
+                temp, cal = self.unpack_status(self.status_buf)
+                self.status = (temp, (cal >> 6) & 0x03, (cal >> 4) & 0x03, (cal >> 2) & 0x03, cal & 0x03)
+                self.next_status = now + CAL_INTERVAL
+
+        h, r, p = self.unpack_euler(self.euler_buf)
+        temp, cal_sys, cal_gyro, cal_accel, cal_mag = self.status
+        row[1] = temp
+        row[2] = h * EULER_SCALE
+        row[3] = r * EULER_SCALE
+        row[4] = p * EULER_SCALE
+        row[5] = cal_sys
+        row[6] = cal_gyro
+        row[7] = cal_accel
+        row[8] = cal_mag
+
+    def read_retry(self, row):
+        """Like read_into(), but retries once after RETRY_WAIT; a second OSError propagates."""
+        try:
+            self.read_into(row)
+        except OSError:
+            self.retries += 1
+            time.sleep(RETRY_WAIT)
+            self.read_into(row)
+
 
 def get_sensor():
     """Initializes the sensor safely."""
@@ -19,55 +101,93 @@ def get_sensor():
         print(f"\nCRITICAL ERROR: Could not connect to sensor.")
         print(f"Error Details: {e}")
         print("1. Check wiring.")
-        print("2. Ensure 'dtparam=i2c_arm_baudrate=10000' is in /boot/firmware/config.txt")
+        print("2. Ensure 'dtparam=i2c_arm_baudrate=400000' is in /boot/firmware/config.txt")
         return None
 
+def set_realtime():
+    """Pins the process to RT_CPU and switches it to SCHED_FIFO; warns instead of failing."""
+    try:
+        os.sched_setaffinity(0, {RT_CPU})
+    except (AttributeError, OSError) as e:
+        print(f"WARNING: Could not pin to CPU {RT_CPU}: {e}")
+    if RT_PRIORITY is None:
+        return
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(RT_PRIORITY))
+    except (AttributeError, OSError) as e:
+        print(f"WARNING: Could not enable SCHED_FIFO (run with sudo for lower jitter): {e}")
+
 def main():
     sensor = get_sensor()
     if not sensor:
         return
+    set_realtime()
+    block = BNO055Block(sensor)
 
     print(f"Logging data to {OUTPUT_FILE}...")
     print("Move the sensor in a figure-8 to calibrate.")
     print("Press Ctrl+C to stop.")
     print("-" * 60)
 
-    # Open CSV file for writing
-    with open(OUTPUT_FILE, mode='w', newline='') as file:
-        writer = csv.writer(file)
+    # Open CSV file for writing. The CSV is pure ASCII, so skip the text layer
+    # (per-write encoding and newline translation) and buffer raw bytes.
+    fd = os.open(OUTPUT_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND | os.O_CLOEXEC, 0o644)
+    with io.BufferedWriter(io.FileIO(fd, 'w', closefd=True), buffer_size=1 << 16) as file:
         # Write the Header Row
-        writer.writerow(["Timestamp", "Temp_C", "Heading", "Roll", "Pitch", "Sys_Cal", "Gyro_Cal", "Accel_Cal", "Mag_Cal"])
-
-        while True:
-            try:
-                # Read Sensor Data
-                temp = sensor.temperature
-                euler = sensor.euler  # (Heading, Roll, Pitch)
-                cal_sys, cal_gyro, cal_accel, cal_mag = sensor.calibration_status
-                
-                # Get current time
-                timestamp = time.strftime("%H:%M:%S")
-
-                # If euler gives None (sensor glitch), use placeholders
-                h, r, p = euler if euler else (0, 0, 0)
-
-                # Print to Screen
-                print(f"[{timestamp}] Temp: {temp}°C | H: {h:.2f} R: {r:.2f} P: {p:.2f} | Cal: {sensor.calibration_status}")
-
-                # Save to File
-                writer.writerow([timestamp, temp, h, r, p, cal_sys, cal_gyro, cal_accel, cal_mag])
-                
-                # Flush ensures data is saved even if you crash
-                file.flush()
-
-                time.sleep(0.2) # Read 5 times a second
-
-            except OSError:
-                print("Clock stretching error... retrying")
-                time.sleep(0.5)
-            except KeyboardInterrupt:
-                print("\nStopped by user.")
-                break
+        file.write(CSV_HEADER.encode('ascii'))
+        write = file.write
+
+        # Wall-clock epoch anchored once, advanced by the monotonic clock:
+        # nanosecond resolution, no localtime() per sample, and never steps
+        # backwards if NTP adjusts the system time mid-run.
+        t0_wall = time.time_ns()
+        t0_mono = time.monotonic_ns()
+        monotonic_ns = time.monotonic_ns
+
+        # Use monotonic scheduling to avoid drift
+        period = 1.0 / SAMPLE_RATE_HZ
+        t_next = time.monotonic()
+        rows = 0
+        samples = 0
+        print_every = max(1, round(SAMPLE_RATE_HZ * PRINT_INTERVAL))
+        row = [None] * 9  # Reused every sample: timestamp + 8 sensor fields
+        try:
+            while True:
+                t_next += period
+                try:
+                    # Read Sensor Data (one burst read, retried once on a bus glitch)
+                    block.read_retry(row)
+
+                    # Get current time (epoch seconds with 9 decimals)
+                    t = t0_wall + (monotonic_ns() - t0_mono)
+                    row[0] = f"{t // 1_000_000_000}.{t % 1_000_000_000:09d}"
+                    values = tuple(row)  # one snapshot shared by print and file
+
+                    # Print to Screen (throttled; terminal writes add jitter)
+                    if samples % print_every == 0:
+                        print(PRINT_FMT % values)
+                    samples += 1
+
+                    # Save to File (buffered; flushed every FLUSH_EVERY rows)
+                    write((ROW_FMT % values).encode('ascii'))
+                    rows += 1
+                    if rows % FLUSH_EVERY == 0:
+                        file.flush()
+
+                except OSError:
+                    # Both attempts failed: drop this sample, keep the schedule
+                    print(f"WARNING: I2C read failed twice, sample skipped ({block.retries} retries so far)")
+
+                # Sleep until next tick (avoid negative)
+                remaining = t_next - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+        except KeyboardInterrupt:
+            print("\nStopped by user.")
+        finally:
+            # Make sure everything buffered reaches the SD card
+            file.flush()
+            os.fsync(file.fileno())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -13,18 +13,33 @@
 # /*                                                                                    */
 # /*====================================================================================*/
 
+from collections import deque
 from datetime import datetime
-from threading import Thread, Condition, Event
+from threading import Thread, Event
 
+import math
 import numpy as np
 import os
-import queue
 import serial
 import signal
+import struct
 import sys
 import zmq
 import time
 
+# Optional: compile the per-notification decoder to native code
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        # No numba: leave the function as plain Python
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
 # Arguments: DS-TWR_Unicast.py [i|r] [COM12] [10] [notime] [noplot|nocirplot] [ipc <prefix_file_name> | <bin_path>]
 #   Role of the Rhodes board ("i" for initiator, "r" for responder)
 #   Communication Port (e.g. "COM12")
@@ -47,6 +62,9 @@ nb_meas = 0
 # To add date and time in the log
 is_timestamp = True
 
+# To dump every UCI frame sent/received in hex (debug, slows the threads down)
+is_log_uci = False
+
 # To display plot of range data
 is_range_plot = True
 
@@ -319,17 +337,20 @@ UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_TH_PDOA = [0x20, 0x04, 0x00, 0x0C,
 #   0x09: TX_TEMPERATURE_COMP
 #   0x0A: PDOA2_OFFSET
 #   0x0B-0x0F: RFU
-UWB_SET_CALIBRATION = [0x2E, 0x11, 0x00, 0x06] + channel_ID + [  # Channel ID
-    0x01, 0x1E, 0x01, 0x00, 0x00  # TX_POWER
-]
-
-UWB_SET_PDOA1_CALIBRATION = [0x2E, 0x11, 0x00, 0x0A] + channel_ID + [  # Channel ID
+CALIB_TX_POWER = [0x01, 0x1E, 0x01, 0x00, 0x00]  # TX_POWER
+CALIB_PDOA1_OFFSET = [
     0x07, 0xB5, 0xfD, 0xB5, 0xfD, 0xB5, 0xfD, 0xB5, 0xfD]  # PDOA1_OFFSET, -47,5° = 0xE83F in Q9.7 hex
-
 # only from A25 FW
-UWB_SET_PDOA2_CALIBRATION = [0x2E, 0x11, 0x00, 0x0A] + channel_ID + [  # Channel ID
+CALIB_PDOA2_OFFSET = [
     0x0A, 0x29, 0x01, 0x29, 0x01, 0x29, 0x01, 0x29, 0x01]  # PDOA2_OFFSET, -46,77° = 0xE89D in Q9.7 hex
 
+UWB_SET_CALIBRATION = [0x2E, 0x11, 0x00, 0x06] + channel_ID + CALIB_TX_POWER  # Channel ID + TX_POWER
+
+UWB_SET_PDOA1_CALIBRATION = [0x2E, 0x11, 0x00, 0x0A] + channel_ID + CALIB_PDOA1_OFFSET  # Channel ID + PDOA1_OFFSET
+
+# only from A25 FW
+UWB_SET_PDOA2_CALIBRATION = [0x2E, 0x11, 0x00, 0x0A] + channel_ID + CALIB_PDOA2_OFFSET  # Channel ID + PDOA2_OFFSET
+
 # Session ID
 # SESSION_ID = [0x78, 0x56, 0x34, 0x12]
 # SESSION_ID = [0x11, 0x11, 0x11, 0x11]
@@ -472,10 +493,12 @@ UWB_SESSION_DEINIT = [0x21, 0x01, 0x00, 0x04] + SESSION_ID
 class SIGINThandler():
     def __init__(self):
         self.sigint = False
+        self.pressed = Event()  # Lets the main thread block until Ctrl+C
 
     def signal_handler(self, signal, frame):
         print("You pressed Ctrl+C!")
         self.sigint = True
+        self.pressed.set()
 
 
 class SessionStates():
@@ -485,41 +508,20 @@ class SessionStates():
         self.allow_stop = Event()
         self.allow_end = Event()
 
+        # Session state -> Event set/clear calls for (allow_config, allow_start, allow_stop, allow_end)
+        cfg, start, stop, end = self.allow_config, self.allow_start, self.allow_stop, self.allow_end
+        self._actions = {
+            0x00: (cfg.set, start.clear, stop.clear, end.clear),  # SESSION_STATE_INIT
+            0x01: (cfg.clear, start.clear, stop.clear, end.set),  # SESSION_STATE_DEINIT
+            0x02: (cfg.set, start.set, stop.set, end.clear),  # SESSION_STATE_ACTIVE
+            0x03: (cfg.set, start.set, stop.clear, end.clear),  # SESSION_STATE_IDLE
+            0xFF: (cfg.clear, start.clear, stop.clear, end.clear),  # SESSION_ERROR
+        }
+
     def set(self, status):
-        if (status == 0x00):
-            # SESSION_STATE_INIT
-            self.allow_config.set()
-            self.allow_start.clear()
-            self.allow_stop.clear()
-            self.allow_end.clear()
-
-        if (status == 0x01):
-            # SESSION_STATE_DEINIT
-            self.allow_config.clear()
-            self.allow_start.clear()
-            self.allow_stop.clear()
-            self.allow_end.set()
-
-        if (status == 0x02):
-            # SESSION_STATE_ACTIVE
-            self.allow_config.set()
-            self.allow_start.set()
-            self.allow_stop.set()
-            self.allow_end.clear()
-
-        if (status == 0x03):
-            # SESSION_STATE_IDLE
-            self.allow_config.set()
-            self.allow_start.set()
-            self.allow_stop.clear()
-            self.allow_end.clear()
-
-        if (status == 0xFF):
-            # SESSION_ERROR
-            self.allow_config.clear()
-            self.allow_start.clear()
-            self.allow_stop.clear()
-            self.allow_end.clear()
+        # Unknown states leave the events untouched
+        for action in self._actions.get(status, ()):
+            action()
 
     def set_all(self):
         self.allow_config.set()
@@ -537,9 +539,14 @@ class SessionStates():
 
 ###########################################################
 serial_port = serial.Serial()
-command_queue = queue.Queue(maxsize=100)
+# Single producer / single consumer command path: deque appends and pops are
+# atomic, command_event only wakes the write thread when it found the deque empty.
+# Producers never block: once full, the oldest pending command is dropped.
+COMMAND_QUEUE_LEN = 256
+command_queue = deque(maxlen=COMMAND_QUEUE_LEN)
+command_event = Event()
 session_status = SessionStates()
-write_wait = Condition()
+rsp_event = Event()  # Set by the read thread when a RSP (or a retry request) arrives
 go_stop = Event()
 stop_write_thread = False
 stop_read_thread = False
@@ -555,6 +562,11 @@ rframe_meas = []
 file_ipc = None
 socket = None
 
+# Receive buffer reused for every UCI frame: 4-byte header + up to 0xFFFF payload bytes
+UCI_HDR_LEN = 4
+_rx_buf = bytearray(UCI_HDR_LEN + 0xFFFF)
+_rx_mv = memoryview(_rx_buf)
+
 # Not draw when index is negative
 range_plot = {"index": -1, "valid": False, "nlos": 0, "distance": 0,
               "azimuth": 0, "elevation": 0, "avg_azimuth": 0, "avg_elevation": 0}
@@ -571,8 +583,9 @@ def output(string):
 
     if (is_ipc):
         if ((file_ipc is not None) and (not file_ipc.closed) and (file_ipc.writable())):
-            # File available for write
-            file_ipc.write(string + "\n")
+            # File available for write (two buffered writes instead of building string + "\n")
+            file_ipc.write(string)
+            file_ipc.write("\n")
 
             return True
     else:
@@ -582,58 +595,127 @@ def output(string):
     return False
 
 
+def enqueue_command(uci_command):
+    if (len(command_queue) == COMMAND_QUEUE_LEN):
+        output("WARNING: command queue full, dropping the oldest command")
+    command_queue.append(uci_command)
+    command_event.set()
+
+
+# Queue a whole command sequence at once; the write thread is woken a single time
+def enqueue_all(uci_commands):
+    dropped = len(command_queue) + len(uci_commands) - COMMAND_QUEUE_LEN
+    if (dropped > 0):
+        output("WARNING: command queue full, dropping the %d oldest command(s)" % dropped)
+    command_queue.extend(uci_commands)
+    command_event.set()
+
+
+DEG_TO_RAD = math.pi / 180.0
+
+
+# Works on scalars and on numpy arrays (element-wise)
 def deg_to_rad(angle_deg):
-    return (angle_deg * np.pi / 180)
+    return angle_deg * DEG_TO_RAD
 
 
+# Field extractors for bytes-like payloads: indexing already yields int
 def extract_seq_cnt(byte_array):
-    return int((byte_array[3] << 24) + (byte_array[2] << 16) + (byte_array[1] << 8) + byte_array[0])
+    return (byte_array[3] << 24) | (byte_array[2] << 16) | (byte_array[1] << 8) | byte_array[0]
 
 
 def extract_nlos(byte_array):
-    return int(byte_array[28])
+    return byte_array[28]
 
 
 def extract_distance(byte_array):
-    return int((byte_array[30] << 8) + byte_array[29])
+    return (byte_array[30] << 8) | byte_array[29]
 
 
 def extract_azimuth(byte_array):
-    return int((byte_array[32] << 8) + byte_array[31])
+    return (byte_array[32] << 8) | byte_array[31]
 
 
 def extract_azimuth_fom(byte_array):
-    return int(byte_array[33])
+    return byte_array[33]
 
 
 def extract_elevation(byte_array):
-    return int((byte_array[35] << 8) + byte_array[34])
+    return (byte_array[35] << 8) | byte_array[34]
 
 
 def extract_elevation_fom(byte_array):
-    return int(byte_array[36])
-
+    return byte_array[36]
 
-def extract_cir(byte_array):
-    cir_raw = []
 
-    for idx in range(0, len(byte_array), 4):
-        cir_sample = byte_array[idx:idx + 4]
+# One CIR tap: signed 16-bit real and imaginary parts, little endian
+CIR_SAMPLE_DTYPE = np.dtype([("re", "<i2"), ("im", "<i2")])
 
-        real = twos_comp(int((cir_sample[1] << 8) + cir_sample[0]), 16)
-        imaginary = twos_comp(int((cir_sample[3] << 8) + cir_sample[2]), 16)
 
-        cir_raw.append(real + 1j * imaginary)
+def extract_cir(byte_array):
+    # Decode all taps at once; the signed dtype does the 2's complement
+    cir_raw = np.frombuffer(byte_array, dtype=CIR_SAMPLE_DTYPE, count=len(byte_array) // 4)
 
-    return np.abs(cir_raw)
+    return np.hypot(cir_raw["re"].astype(np.float32), cir_raw["im"].astype(np.float32))
 
 
 def extract_pdoa1(byte_array):
-    return int((byte_array[67] << 8) + byte_array[66])
+    return (byte_array[67] << 8) | byte_array[66]
 
 
 def extract_pdoa2(byte_array):
-    return int((byte_array[71] << 8) + byte_array[70])
+    return (byte_array[71] << 8) | byte_array[70]
+
+
+# RANGE_DATA_NTF fields at fixed payload offsets, decoded in one C call:
+# seq_cnt @0, nlos @28, distance @29, azimuth @31, azimuth_fom @33, elevation @34, elevation_fom @36
+# Angles and PDoA are signed Q9.7, so "h" already does the 2's complement
+RANGE_NTF_STRUCT = struct.Struct("<I24xBHhBhB")
+# pdoa1 @66, pdoa2 @70 (only present when the payload is longer than 71 bytes)
+RANGE_NTF_PDOA_STRUCT = struct.Struct("<66xh2xh")
+
+
+def unpack_range_ntf(buf):
+    # Same fields and order as parse_range_ntf, via struct (no numba needed)
+    if (len(buf) > 71):
+        return RANGE_NTF_STRUCT.unpack_from(buf) + (True,) + RANGE_NTF_PDOA_STRUCT.unpack_from(buf)
+    return RANGE_NTF_STRUCT.unpack_from(buf) + (False, 0, 0)
+
+
+@njit(cache=True, error_model="numpy", boundscheck=False)
+def parse_range_ntf(buf):
+    # Decode every raw field of a RANGE_DATA_NTF payload in one call:
+    # (seq_cnt, nlos, distance, azimuth, azimuth_fom, elevation, elevation_fom, has_pdoa, pdoa1, pdoa2)
+    # Angles and PDoA are raw signed Q9.7 values (scale by Q9_7_SCALE)
+    seq_cnt = (int(buf[3]) << 24) | (int(buf[2]) << 16) | (int(buf[1]) << 8) | int(buf[0])
+    nlos = int(buf[28])
+    distance = (int(buf[30]) << 8) | int(buf[29])
+    azimuth = (int(buf[32]) << 8) | int(buf[31])
+    if azimuth >= 0x8000:
+        azimuth -= 0x10000
+    azimuth_fom = int(buf[33])
+    elevation = (int(buf[35]) << 8) | int(buf[34])
+    if elevation >= 0x8000:
+        elevation -= 0x10000
+    elevation_fom = int(buf[36])
+
+    has_pdoa = len(buf) > 71
+    pdoa1 = 0
+    pdoa2 = 0
+    if has_pdoa:
+        pdoa1 = (int(buf[67]) << 8) | int(buf[66])
+        if pdoa1 >= 0x8000:
+            pdoa1 -= 0x10000
+        pdoa2 = (int(buf[71]) << 8) | int(buf[70])
+        if pdoa2 >= 0x8000:
+            pdoa2 -= 0x10000
+
+    return seq_cnt, nlos, distance, azimuth, azimuth_fom, elevation, elevation_fom, has_pdoa, pdoa1, pdoa2
+
+
+if not HAS_NUMBA:
+    # Interpreted byte shifts are slower than the struct decoder
+    parse_range_ntf = unpack_range_ntf
 
 
 def twos_comp(val, bits):
@@ -643,74 +725,67 @@ def twos_comp(val, bits):
     return val
 
 
-def convert_qformat_to_float(q_in, n_ints, n_fracs, round_of=2):
-    bits = n_ints + n_fracs
-
-    # Compute the 2's complement of integer q_in with the width of n_ints + n_fracs
-    if (q_in & (1 << (bits - 1))) != 0:  # If sign bit is set
-        q_in = q_in - (1 << bits)  # Compute negative value
+# Scale of a signed Q9.7 value already sign-extended (e.g. by an int16 decode)
+Q9_7_SCALE = 1.0 / (1 << 7)
 
-    # Divide by 2^n_fracs
-    frac = q_in / (1 << n_fracs)
 
-    # Return rounded value
-    return round(frac, round_of)
+RANGE_NTF_LINE_FMT = "***(%d) NLos:%d   Dist:%d   Azimuth:%f (FOM:%d)   Elevation:%f (FOM:%d)  PDoA1:%f   PDoA2:%f"
 
 
 def write_to_serial_port():
     global stop_write_thread
-    global command_queue
-    global session_status
-    global go_stop
-    global write_wait
-    global serial_port
     global retry_cmd
     global is_timestamp
 
+    # Objects used on every command, bound once as locals (never rebound at module level)
+    port = serial_port
+    rsp_received = rsp_event
+    pending = command_queue
+    pending_event = command_event
+
+    # GID/OID bytes of a command -> events to wait for, in order, before sending it
+    wait_map = {
+        b"\x21\x03": (session_status.allow_config,),  # APP Configs: wait Session State Initialized
+        b"\x22\x00": (session_status.allow_start,),  # Start ranging: wait Session State Idle
+        # Stop ranging: wait Session State Activated, then reach limit of measurements
+        b"\x22\x01": (session_status.allow_stop, go_stop),
+    }
+
     output("Write to serial port started")
     while (not stop_write_thread):
         if (retry_cmd):
             retry_cmd = False
         else:
-            uci_command = command_queue.get()
+            while (not pending):
+                pending_event.wait()
+                pending_event.clear()
+            uci_command = pending.popleft()
 
-        if (uci_command[0] == 0xFF and uci_command[1] == 0xFF):
+        if (uci_command == END_OF_WRITE):
             break
 
-        usb_out_packet = bytearray()
-        usb_out_packet.append(0x01)
-        usb_out_packet.append(0x00)
-        usb_out_packet.append(len(uci_command))
-        usb_out_packet.extend(uci_command)
-
-        if (uci_command[0] == 0x21 and uci_command[1] == 0x03):
-            # Wait Session State Initialized to send APP Configs
-            session_status.allow_config.wait()
-        if (uci_command[0] == 0x22 and uci_command[1] == 0x00):
-            # Wait Session State Idle to start ranging
-            session_status.allow_start.wait()
-        if (uci_command[0] == 0x22 and uci_command[1] == 0x01):
-            # Wait Session State Activated
-            session_status.allow_stop.wait()
-            # Wait reach limit of measurements to stop ranging
-            go_stop.wait()
-
-        write_wait.acquire()  # Acquire Lock to avoid mixing in output
-        if serial_port.isOpen():
-            # if (is_timestamp):
-            #     output(datetime.now().isoformat(sep=" ", timespec="milliseconds") + "NXPUCIX => " + \
-            #            "".join("{:02x} ".format(x) for x in uci_command))
-            # else:
-            #     output("NXPUCIX => " + "".join("{:02x} ".format(x) for x in uci_command))
-
-            serial_port.write(serial.to_bytes(usb_out_packet))
+        # Commands in the queue are already framed (see _frame)
+        for event in wait_map.get(uci_command[FRAME_HDR_LEN:FRAME_HDR_LEN + 2], ()):
+            event.wait()
+
+        if port.isOpen():
+            if (is_log_uci):
+                # bytes.hex(" ") formats in C instead of one format() call per byte
+                if (is_timestamp):
+                    output(datetime.now().isoformat(sep=" ", timespec="milliseconds") + "NXPUCIX => " + \
+                           uci_command[FRAME_HDR_LEN:].hex(" "))
+                else:
+                    output("NXPUCIX => " + uci_command[FRAME_HDR_LEN:].hex(" "))
+
+            # Clear before sending so a stale RSP cannot satisfy the wait below
+            rsp_received.clear()
+            port.write(uci_command)
 
             # stop_write_thread = True
             
             # Wait the reception of RSP or timeout of 0.25s before allowing send of new CMD
-            notified = write_wait.wait(0.25)
+            notified = rsp_received.wait(0.25)
             if (not (notified)): retry_cmd = True  # Repeat command if timeout
-        write_wait.release()
 
     output("Write to serial port exited")
 
@@ -745,6 +820,60 @@ UWB_SESSION_SET_INITIATOR_CONFIG_2 = [0x21, 0x03, 0x00, 0x13] + SESSION_ID + [
                                     0x11, 0x01, 0x01  # DEVICE_ROLE: Initiator
                                     ]
 
+
+# USB packet framing (0x01 0x00 + length) is prepended to every UCI command.
+# Static commands are framed once here so the write thread only calls write().
+def _frame(cmd):
+    b = bytes(cmd)
+    return b'\x01\x00' + bytes([len(b)]) + b
+
+
+FRAME_HDR_LEN = 3  # GID/OID of a framed command are at [3] and [4]
+# USB framing (0x01 0x00 len) followed by the UCI header (MT|GID, OID, RFU, payload len)
+FRAMED_CMD_HDR = struct.Struct("<BBBBBBB")
+
+
+def build_cmd(mt_gid, oid, payload):
+    # Framed UCI command straight from its payload; both length bytes are computed
+    payload = bytes(payload)
+    return FRAMED_CMD_HDR.pack(0x01, 0x00, len(payload) + 4, mt_gid, oid, 0x00, len(payload)) + payload
+
+
+def build_calibration_cmds(channel):
+    # Channel-specific calibration commands (TX power, PDOA1/PDOA2 offsets); call again to switch channel
+    return (build_cmd(0x2E, 0x11, [channel] + CALIB_TX_POWER),
+            build_cmd(0x2E, 0x11, [channel] + CALIB_PDOA1_OFFSET),
+            build_cmd(0x2E, 0x11, [channel] + CALIB_PDOA2_OFFSET))
+
+
+END_OF_WRITE = b'\xff\xff'  # Sentinel, never sent
+UWB_GET_DEVICE_INFO_FRAMED = build_cmd(0x20, 0x02, b"")
+UWB_GET_DEVICE_CAPS_FRAMED = build_cmd(0x20, 0x03, b"")
+UWB_SET_BOARD_VARIANT_FRAMED = _frame(UWB_SET_BOARD_VARIANT)
+UWB_RESET_DEVICE_FRAMED = _frame(UWB_RESET_DEVICE)
+UWB_CORE_SET_CONFIG_FRAMED = _frame(UWB_CORE_SET_CONFIG)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH5_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH5)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH5_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH5)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH9_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH9)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH9_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH9)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_AVG_PDOA_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_AVG_PDOA)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_TH_PDOA_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_TH_PDOA)
+UWB_SET_CALIBRATION_FRAMED, UWB_SET_PDOA1_CALIBRATION_FRAMED, UWB_SET_PDOA2_CALIBRATION_FRAMED = \
+    build_calibration_cmds(channel_ID[0])
+UWB_SESSION_INIT_RANGING_FRAMED = _frame(UWB_SESSION_INIT_RANGING)
+UWB_SESSION_SET_APP_CONFIG_FRAMED = _frame(UWB_SESSION_SET_APP_CONFIG)
+UWB_SESSION_SET_INITIATOR_CONFIG_FRAMED = _frame(UWB_SESSION_SET_INITIATOR_CONFIG)
+UWB_SESSION_SET_RESPONDER_CONFIG_FRAMED = _frame(UWB_SESSION_SET_RESPONDER_CONFIG)
+UWB_SESSION_SET_DEBUG_CONFIG_FRAMED = _frame(UWB_SESSION_SET_DEBUG_CONFIG)
+UWB_RANGE_START_FRAMED = _frame(UWB_RANGE_START)
+UWB_RANGE_STOP_FRAMED = _frame(UWB_RANGE_STOP)
+UWB_SESSION_DEINIT_FRAMED = _frame(UWB_SESSION_DEINIT)
+UWB_SESSION_SET_RESPONDER_CONFIG_1_FRAMED = _frame(UWB_SESSION_SET_RESPONDER_CONFIG_1)
+UWB_SESSION_SET_RESPONDER_CONFIG_2_FRAMED = _frame(UWB_SESSION_SET_RESPONDER_CONFIG_2)
+UWB_SESSION_SET_INITIATOR_CONFIG_1_FRAMED = _frame(UWB_SESSION_SET_INITIATOR_CONFIG_1)
+UWB_SESSION_SET_INITIATOR_CONFIG_2_FRAMED = _frame(UWB_SESSION_SET_INITIATOR_CONFIG_2)
+
+
 def change_state():
     global command_queue
     global current_state
@@ -752,53 +881,50 @@ def change_state():
     global rhodes_role
     print(time.time()-state_time)
     state_time = time.time()
-    # command_queue.put(UWB_SET_BOARD_VARIANT)
-    # command_queue.put(UWB_RESET_DEVICE)
-    # command_queue.put([0x20, 0x02, 0x00, 0x00])  # Get Device Information
-    # command_queue.put([0x20, 0x03, 0x00, 0x00])  # Get Device Capability
-
-    # command_queue.put(UWB_CORE_SET_CONFIG)
-    # command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH5)
-    # command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH5)
-    # command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH9)
-    # command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH9)
-    # command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_AVG_PDOA)
-    # command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_TH_PDOA)
-    # command_queue.put(UWB_SET_CALIBRATION)
-    # command_queue.put(UWB_SET_PDOA1_CALIBRATION)
-    # command_queue.put(UWB_SET_PDOA2_CALIBRATION)
-
-    command_queue.put(UWB_SESSION_DEINIT)
-    command_queue.put(UWB_SESSION_INIT_RANGING)
-    command_queue.put(UWB_SESSION_SET_APP_CONFIG)
+    # enqueue_command(UWB_SET_BOARD_VARIANT_FRAMED)
+    # enqueue_command(UWB_RESET_DEVICE_FRAMED)
+    # enqueue_command(UWB_GET_DEVICE_INFO_FRAMED)  # Get Device Information
+    # enqueue_command(UWB_GET_DEVICE_CAPS_FRAMED)  # Get Device Capability
+
+    # enqueue_command(UWB_CORE_SET_CONFIG_FRAMED)
+    # enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH5_FRAMED)
+    # enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH5_FRAMED)
+    # enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH9_FRAMED)
+    # enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH9_FRAMED)
+    # enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_AVG_PDOA_FRAMED)
+    # enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_TH_PDOA_FRAMED)
+    # enqueue_command(UWB_SET_CALIBRATION_FRAMED)
+    # enqueue_command(UWB_SET_PDOA1_CALIBRATION_FRAMED)
+    # enqueue_command(UWB_SET_PDOA2_CALIBRATION_FRAMED)
+
+    cmds = [UWB_SESSION_DEINIT_FRAMED,
+            UWB_SESSION_INIT_RANGING_FRAMED,
+            UWB_SESSION_SET_APP_CONFIG_FRAMED]
     if(current_state==1):
-        # if (rhodes_role == "Initiator"): command_queue.put(UWB_SESSION_SET_INITIATOR_CONFIG_2)
-        # if (rhodes_role == "Responder"): command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG_2)
-        command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG_2)
+        # if (rhodes_role == "Initiator"): cmds.append(UWB_SESSION_SET_INITIATOR_CONFIG_2_FRAMED)
+        # if (rhodes_role == "Responder"): cmds.append(UWB_SESSION_SET_RESPONDER_CONFIG_2_FRAMED)
+        cmds.append(UWB_SESSION_SET_RESPONDER_CONFIG_2_FRAMED)
         current_state = 2
         print("State 2")
     elif(current_state==2):
-        # if (rhodes_role == "Initiator"): command_queue.put(UWB_SESSION_SET_INITIATOR_CONFIG_1)
-        # if (rhodes_role == "Responder"): command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG_1)
-        command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG_1)
+        # if (rhodes_role == "Initiator"): cmds.append(UWB_SESSION_SET_INITIATOR_CONFIG_1_FRAMED)
+        # if (rhodes_role == "Responder"): cmds.append(UWB_SESSION_SET_RESPONDER_CONFIG_1_FRAMED)
+        cmds.append(UWB_SESSION_SET_RESPONDER_CONFIG_1_FRAMED)
         current_state = 1
         print("State 1")
     # elif(current_state==3):
-    #     if (rhodes_role == "Initiator"): command_queue.put(UWB_SESSION_SET_INITIATOR_CONFIG_2)
-    #     if (rhodes_role == "Responder"): command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG_2)
-    #     # command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG_1)
+    #     if (rhodes_role == "Initiator"): cmds.append(UWB_SESSION_SET_INITIATOR_CONFIG_2_FRAMED)
+    #     if (rhodes_role == "Responder"): cmds.append(UWB_SESSION_SET_RESPONDER_CONFIG_2_FRAMED)
+    #     # cmds.append(UWB_SESSION_SET_RESPONDER_CONFIG_1_FRAMED)
     #     current_state = 1
     #     print("State 2")
-    command_queue.put(UWB_RANGE_START)
+    cmds.append(UWB_RANGE_START_FRAMED)
+    enqueue_all(cmds)
 
 
 def read_from_serial_port():
     global stop_read_thread
-    global serial_port
-    global write_wait
     global retry_cmd
-    global session_status
-    global go_stop
     global nb_meas
     global is_timestamp
     global meas_idx
@@ -821,93 +947,96 @@ def read_from_serial_port():
     meas_pdoa1 = 0
     meas_pdoa2 = 0
     avg_window_size = 15
-    hist_distance = []
-    hist_azimuth = []
-    hist_elevation = []
-    hist_pdoa1 = []
-    hist_pdoa2 = []
+    # Moving-average history: one row per signal (distance, azimuth, elevation, pdoa1, pdoa2),
+    # one column per measurement, overwritten in a circle
+    hist = np.zeros((5, avg_window_size))
+    hist_col = 0
+    hist_len = 0
     is_stored = False
 
+    # Objects used on every frame, bound once as locals (never rebound at module level)
+    port = serial_port
+    rsp_received = rsp_event
+    stop_event = go_stop
+    set_session_state = session_status.set
+    rx_mv = _rx_mv
+    decode_ntf = parse_range_ntf
+    frombuffer = np.frombuffer
+    q_scale = Q9_7_SCALE
+
     output("Read from serial port started")
     while (not stop_read_thread):
-        if serial_port.isOpen():
-            if serial_port.isOpen():
-                uci_hdr = serial_port.read(4)  # Read header of UCI frame
-                write_wait.acquire()  # Acquire Lock to avoid mixing in output
-                if len(uci_hdr) == 4:
+        if port.isOpen():
+            if port.isOpen():
+                uci_hdr = rx_mv[:UCI_HDR_LEN]
+                hdr_len = port.readinto(uci_hdr)  # Read header of UCI frame
+                if hdr_len == UCI_HDR_LEN:
                     count = uci_hdr[3]
                     if (uci_hdr[1] & 0x80) == 0x80:
                         # Extended length
                         count = int((uci_hdr[3] << 8) + uci_hdr[2])
                     if count > 0:
-                        if serial_port.isOpen():
-                            uci_payload = serial_port.read(count)  # Read payload of UCI frame
-
-                            # if (is_timestamp):
-                            #     is_stored = output(datetime.now().isoformat(sep=" ", timespec="milliseconds") + \
-                            #                        "NXPUCIR <= " + "".join("{:02x} ".format(h) for h in uci_hdr) + \
-                            #                        "".join("{:02x} ".format(p) for p in uci_payload))
-                            # else:
-                            #     is_stored = output("NXPUCIR <= " + "".join("{:02x} ".format(h) for h in uci_hdr) + \
-                            #                        "".join("{:02x} ".format(p) for p in uci_payload))
-
-                            if len(uci_payload) == count:
-                                if (uci_hdr[0] & 0xF0) == 0x40: write_wait.notify()  # Notify the reception of RSP
+                        if port.isOpen():
+                            # Read payload of UCI frame into the same buffer; uci_payload is a view, not a copy
+                            uci_payload = rx_mv[UCI_HDR_LEN:UCI_HDR_LEN + count]
+                            payload_len = port.readinto(uci_payload)
+
+                            if (is_log_uci):
+                                # Header and payload are contiguous in the receive buffer
+                                if (is_timestamp):
+                                    is_stored = output(datetime.now().isoformat(sep=" ", timespec="milliseconds") + \
+                                                       "NXPUCIR <= " + rx_mv[:UCI_HDR_LEN + count].hex(" "))
+                                else:
+                                    is_stored = output("NXPUCIR <= " + rx_mv[:UCI_HDR_LEN + count].hex(" "))
+
+                            if payload_len == count:
+                                if (uci_hdr[0] & 0xF0) == 0x40: rsp_received.set()  # Notify the reception of RSP
 
                                 if (uci_hdr[0] == 0x60 and uci_hdr[1] == 0x07 and uci_hdr[3] == 0x01 and \
                                         uci_payload[0] == 0x0A):
                                     # Command retry without wait response
                                     retry_cmd = True
-                                    write_wait.notify()
+                                    rsp_received.set()
 
                                 if (uci_hdr[0] == 0x61 and uci_hdr[1] == 0x02 and uci_hdr[3] == 0x06):
                                     # Change Session state
-                                    session_status.set(uci_payload[4])
+                                    set_session_state(uci_payload[4])
                                     if (uci_payload[5] == 0x01):
                                         # Session termination on max RR Retry
-                                        go_stop.set()
+                                        stop_event.set()
 
                                 if (uci_hdr[0] == 0x62 and uci_hdr[1] == 0x00):
                                     # RANGE_DATA_NTF
-                                    seq_cnt = extract_seq_cnt(uci_payload)
                                     # Check Status
                                     if (uci_payload[27] != 0x00):
                                         output("***** Ranging Error Detected ****")
                                     else:
-                                        meas_nlos = (extract_nlos(uci_payload))
-                                        meas_distance = (extract_distance(uci_payload))
-                                        meas_azimuth = convert_qformat_to_float(extract_azimuth(uci_payload), 9, 7, 1)
-                                        meas_azimuth_fom = (extract_azimuth_fom(uci_payload))
-                                        meas_elevation = convert_qformat_to_float(extract_elevation(uci_payload), 9, 7,
-                                                                                  1)
-                                        meas_elevation_fom = (extract_elevation_fom(uci_payload))
+                                        # All fields in one call (numba on a uint8 array, else struct on the buffer)
+                                        (seq_cnt, meas_nlos, meas_distance, raw_azimuth, meas_azimuth_fom,
+                                         raw_elevation, meas_elevation_fom, has_pdoa, raw_pdoa1, raw_pdoa2) = \
+                                            decode_ntf(frombuffer(uci_payload, dtype=np.uint8) if HAS_NUMBA
+                                                            else uci_payload)
+                                        meas_azimuth = round(raw_azimuth * q_scale, 1)
+                                        meas_elevation = round(raw_elevation * q_scale, 1)
 
                                         # added by maya, 20210618
-                                        if (len(uci_payload) > 71):
-                                            meas_pdoa1 = convert_qformat_to_float(extract_pdoa1(uci_payload), 9, 7, 7)
-                                            meas_pdoa2 = convert_qformat_to_float(extract_pdoa2(uci_payload), 9, 7, 7)
-
-                                        hist_distance.append(meas_distance)
-                                        hist_azimuth.append(meas_azimuth)
-                                        hist_elevation.append(meas_elevation)
-                                        hist_pdoa1.append(meas_pdoa1)
-                                        hist_pdoa2.append(meas_pdoa2)
-
-                                        if (len(hist_distance) > avg_window_size): hist_distance.pop(0)
-                                        if (len(hist_azimuth) > avg_window_size): hist_azimuth.pop(0)
-                                        if (len(hist_elevation) > avg_window_size): hist_elevation.pop(0)
-                                        if (len(hist_pdoa1) > avg_window_size): hist_pdoa1.pop(0)
-                                        if (len(hist_pdoa2) > avg_window_size): hist_pdoa2.pop(0)
-
-                                        avg_distance = sum(hist_distance) / len(hist_distance)
-                                        avg_azimuth = sum(hist_azimuth) / len(hist_azimuth)
-                                        avg_elevation = sum(hist_elevation) / len(hist_elevation)
-                                        avg_pdoa1 = sum(hist_pdoa1) / len(hist_pdoa1)
-                                        avg_pdoa2 = sum(hist_pdoa2) / len(hist_pdoa2)
-                                        output(
-                                            "***(%d) NLos:%d   Dist:%d   Azimuth:%f (FOM:%d)   Elevation:%f (FOM:%d)  PDoA1:%f   PDoA2:%f" \
-                                            % (seq_cnt, meas_nlos, meas_distance, meas_azimuth, meas_azimuth_fom,
-                                               meas_elevation, meas_elevation_fom, meas_pdoa1, meas_pdoa2))
+                                        if (has_pdoa):
+                                            # Q9.7 is exact at 7 decimals, no rounding needed
+                                            meas_pdoa1 = raw_pdoa1 * q_scale
+                                            meas_pdoa2 = raw_pdoa2 * q_scale
+
+                                        hist[:, hist_col] = (meas_distance, meas_azimuth, meas_elevation,
+                                                             meas_pdoa1, meas_pdoa2)
+                                        hist_col += 1
+                                        if (hist_col == avg_window_size): hist_col = 0
+                                        if (hist_len < avg_window_size): hist_len += 1
+
+                                        # All five means in one call (only filled columns until the window is full)
+                                        avg_distance, avg_azimuth, avg_elevation, avg_pdoa1, avg_pdoa2 = \
+                                            (hist if hist_len == avg_window_size else hist[:, :hist_len]).mean(axis=1)
+                                        output(RANGE_NTF_LINE_FMT
+                                               % (seq_cnt, meas_nlos, meas_distance, meas_azimuth, meas_azimuth_fom,
+                                                  meas_elevation, meas_elevation_fom, meas_pdoa1, meas_pdoa2))
                                         # output(
                                         #     "*** Avg Dist:%d   Avg Azimuth:%f   Avg Elevation:%f   Avg_PDoA1:%f   Avg_PDoA2:%f" \
                                         #     % (avg_distance, avg_azimuth, avg_elevation, avg_pdoa1, avg_pdoa2))
@@ -918,24 +1047,23 @@ def read_from_serial_port():
                                             meas_idx += 1
 
                                         if (nb_meas > 0 and meas_idx > nb_meas):
-                                            go_stop.set()
+                                            stop_event.set()
                                     change_state()
                             else:
                                 output("\nExpected Payload bytes is " + str(count) + \
-                                       ", Actual Paylod bytes received is " + str(len(uci_payload)))
+                                       ", Actual Paylod bytes received is " + str(payload_len))
                         else:
                             output("Port is not opened")
                     else:
                         output("\nUCI Payload Size is Zero")
                 else:
                     output("\nUCI Header is not valid")
-                write_wait.release()
             else:
                 output("Port is not opened (2)")
         else:
             output("Port is not opened (1)")
 
-    if serial_port.isOpen(): serial_port.close()
+    if port.isOpen(): serial_port.close()
 
     output("Read from serial port exited")
 
@@ -987,15 +1115,12 @@ def start_processing():
     # session_status.allow_end.set()
 
     # while (session_status.allow_end.is_set() == False):
-    while(1):
+    # Sleep until Ctrl+C instead of spinning; wake every 5 s for the elapsed-time print
+    while (not handler.pressed.wait(5)):
         current_time = time.time()
-        if(current_time-start_time>=5):
-            print("Time elapsed since reset = " + str(current_time-start_time))
-            start_time = time.time()
-            # change_state()
-
-        if handler.sigint:
-            break
+        print("Time elapsed since reset = " + str(current_time-start_time))
+        start_time = time.time()
+        # change_state()
     
     # To restore output on STDOUT
     is_ipc = False
@@ -1006,7 +1131,7 @@ def start_processing():
     stop_ipc_thread = True
 
     # Unblock the waiting in the write thread
-    command_queue.put([0xFF, 0xFF])  # End of write
+    enqueue_command(END_OF_WRITE)  # End of write
     session_status.set_all()
     go_stop.set()
 
@@ -1015,7 +1140,7 @@ def reset_stuff():
     global serial_port
     global command_queue
     global session_status
-    global write_wait
+    global rsp_event
     global go_stop
     global stop_write_thread
     global stop_read_thread
@@ -1034,9 +1159,11 @@ def reset_stuff():
     # serial_port = serial.Serial()
     open_serial_port()
 
-    command_queue = queue.Queue(maxsize=100)
+    command_queue.clear()
+    command_event.clear()
     session_status.clear_all()
     go_stop.clear()
+    rsp_event.clear()
 
     stop_write_thread = False
     stop_read_thread = False
@@ -1109,32 +1236,32 @@ def main():
 
         # Add the UCI Commands to sent
         output("Start adding commands to the queue...")
-        command_queue.put(UWB_SET_BOARD_VARIANT)
-        command_queue.put(UWB_RESET_DEVICE)
-        command_queue.put([0x20, 0x02, 0x00, 0x00])  # Get Device Information
-        command_queue.put([0x20, 0x03, 0x00, 0x00])  # Get Device Capability
-
-        command_queue.put(UWB_CORE_SET_CONFIG)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH5)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH5)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH9)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH9)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_AVG_PDOA)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_TH_PDOA)
-        command_queue.put(UWB_SET_CALIBRATION)
-        command_queue.put(UWB_SET_PDOA1_CALIBRATION)
-        command_queue.put(UWB_SET_PDOA2_CALIBRATION)
-
-        command_queue.put(UWB_SESSION_INIT_RANGING)
-        command_queue.put(UWB_SESSION_SET_APP_CONFIG)
-        if (rhodes_role == "Initiator"): command_queue.put(UWB_SESSION_SET_INITIATOR_CONFIG)
-        if (rhodes_role == "Responder"): command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG)
-        command_queue.put(UWB_SESSION_SET_DEBUG_CONFIG)
-
-        command_queue.put(UWB_RANGE_START)
+        enqueue_command(UWB_SET_BOARD_VARIANT_FRAMED)
+        enqueue_command(UWB_RESET_DEVICE_FRAMED)
+        enqueue_command(UWB_GET_DEVICE_INFO_FRAMED)  # Get Device Information
+        enqueue_command(UWB_GET_DEVICE_CAPS_FRAMED)  # Get Device Capability
+
+        enqueue_command(UWB_CORE_SET_CONFIG_FRAMED)
+        enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH5_FRAMED)
+        enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH5_FRAMED)
+        enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH9_FRAMED)
+        enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH9_FRAMED)
+        enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_AVG_PDOA_FRAMED)
+        enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_TH_PDOA_FRAMED)
+        enqueue_command(UWB_SET_CALIBRATION_FRAMED)
+        enqueue_command(UWB_SET_PDOA1_CALIBRATION_FRAMED)
+        enqueue_command(UWB_SET_PDOA2_CALIBRATION_FRAMED)
+
+        enqueue_command(UWB_SESSION_INIT_RANGING_FRAMED)
+        enqueue_command(UWB_SESSION_SET_APP_CONFIG_FRAMED)
+        if (rhodes_role == "Initiator"): enqueue_command(UWB_SESSION_SET_INITIATOR_CONFIG_FRAMED)
+        if (rhodes_role == "Responder"): enqueue_command(UWB_SESSION_SET_RESPONDER_CONFIG_FRAMED)
+        enqueue_command(UWB_SESSION_SET_DEBUG_CONFIG_FRAMED)
+
+        enqueue_command(UWB_RANGE_START_FRAMED)
         if (nb_meas > 0):
-            command_queue.put(UWB_RANGE_STOP)
-            command_queue.put(UWB_SESSION_DEINIT)
+            enqueue_command(UWB_RANGE_STOP_FRAMED)
+            enqueue_command(UWB_SESSION_DEINIT_FRAMED)
         output("adding commands to the queue completed")
 
 
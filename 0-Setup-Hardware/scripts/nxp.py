@@ -13,17 +13,20 @@
 # /*                                                                                    */
 # /*====================================================================================*/
 
+from collections import deque
 from datetime import datetime
+from queue import Full
 from threading import Thread, Condition, Event
 
 import numpy as np
 import os
-import queue
 import serial
 import signal
+import struct
 import sys
 import zmq
 import time
+from socket import socket as Socket, AF_UNIX, SOCK_DGRAM
 
 # Arguments: DS-TWR_Unicast.py [i|r] [COM12] [10] [notime] [noplot|nocirplot] [ipc <prefix_file_name> | <bin_path>]
 #   Role of the Rhodes board ("i" for initiator, "r" for responder)
@@ -32,6 +35,7 @@ import time
 #   Don't put date and time in the log
 #   "noplot" to not display all the plots or "nocirplot" to display plots of distance and AoA but nor CIR amplitude
 #   "ipc" to store all output into file which name is controled by IPC (in this case, timestamp and plots are disabled)
+#   "sock" to send each measurement as a binary datagram to MEAS_SOCK_PATH instead of printing it
 #   or bin_path to store CIR, RFrame and Range Data notifications in binary files (no store if empty)
 
 
@@ -59,6 +63,15 @@ is_ipc = False
 # Prefixe of output files in IPC mode
 prefix_ipc = ""
 
+# To send measurements as binary datagrams on a Unix socket
+is_meas_sock = False
+
+# Unix datagram socket read by the logging scripts (e.g. validate_nodes.py)
+MEAS_SOCK_PATH = "/tmp/uwb.sock"
+
+# One datagram per measurement: seq_cnt, nlos, distance (cm), azimuth, elevation (deg)
+MEAS_STRUCT = struct.Struct("<IBHff")
+
 # added on 2021.07.15
 channel_ID = [0x09]
 
@@ -472,10 +485,12 @@ UWB_SESSION_DEINIT = [0x21, 0x01, 0x00, 0x04] + SESSION_ID
 class SIGINThandler():
     def __init__(self):
         self.sigint = False
+        self.pressed = Event()  # Lets the main thread block until Ctrl+C
 
     def signal_handler(self, signal, frame):
         print("You pressed Ctrl+C!")
         self.sigint = True
+        self.pressed.set()
 
 
 class SessionStates():
@@ -537,7 +552,13 @@ class SessionStates():
 
 ###########################################################
 serial_port = serial.Serial()
-command_queue = queue.Queue(maxsize=100)
+# Command path to the write thread: deque appends and pops are atomic, so no
+# lock is taken per command; command_event only wakes the write thread when it
+# found the deque empty. Producers never block: once full, the oldest pending
+# command is dropped.
+COMMAND_QUEUE_LEN = 256
+command_queue = deque(maxlen=COMMAND_QUEUE_LEN)
+command_event = Event()
 session_status = SessionStates()
 write_wait = Condition()
 go_stop = Event()
@@ -554,6 +575,11 @@ rframe_nb = 0
 rframe_meas = []
 file_ipc = None
 socket = None
+# Set by run(): receives a (seq_cnt, distance, azimuth, elevation, nlos) tuple per measurement
+# (bound it: measurements are dropped when it is full)
+range_queue = None
+# Connected Unix datagram socket in "sock" mode
+meas_sock = None
 
 # Not draw when index is negative
 range_plot = {"index": -1, "valid": False, "nlos": 0, "distance": 0,
@@ -563,6 +589,19 @@ range_plot = {"index": -1, "valid": False, "nlos": 0, "distance": 0,
 cir_plot = {"nb_meas": 0, "mappings": [], "cir_samples": []}
 
 
+# Connect the measurement socket; return None (print instead) if no reader is listening
+# Non-blocking, so a slow reader makes send() fail instead of stalling the serial read loop
+def open_meas_socket(path):
+    try:
+        sock = Socket(AF_UNIX, SOCK_DGRAM)
+        sock.connect(path)
+        sock.setblocking(False)
+    except OSError as e:
+        output("WARNING: cannot connect to " + path + " (" + str(e) + "), printing measurements instead")
+        return None
+    return sock
+
+
 # Output string on STDOUT or store into file depending of IPC mode
 # Return True is success to write string into file
 def output(string):
@@ -582,12 +621,23 @@ def output(string):
     return False
 
 
+def enqueue_command(uci_command):
+    if (len(command_queue) == COMMAND_QUEUE_LEN):
+        output("WARNING: command queue full, dropping the oldest command")
+    command_queue.append(uci_command)
+    command_event.set()
+
+
 def deg_to_rad(angle_deg):
     return (angle_deg * np.pi / 180)
 
 
+UINT32_LE = struct.Struct("<I")
+UINT16_LE = struct.Struct("<H")
+
+
 def extract_seq_cnt(byte_array):
-    return int((byte_array[3] << 24) + (byte_array[2] << 16) + (byte_array[1] << 8) + byte_array[0])
+    return UINT32_LE.unpack_from(byte_array, 0)[0]
 
 
 def extract_nlos(byte_array):
@@ -595,11 +645,11 @@ def extract_nlos(byte_array):
 
 
 def extract_distance(byte_array):
-    return int((byte_array[30] << 8) + byte_array[29])
+    return UINT16_LE.unpack_from(byte_array, 29)[0]
 
 
 def extract_azimuth(byte_array):
-    return int((byte_array[32] << 8) + byte_array[31])
+    return UINT16_LE.unpack_from(byte_array, 31)[0]
 
 
 def extract_azimuth_fom(byte_array):
@@ -607,7 +657,7 @@ def extract_azimuth_fom(byte_array):
 
 
 def extract_elevation(byte_array):
-    return int((byte_array[35] << 8) + byte_array[34])
+    return UINT16_LE.unpack_from(byte_array, 34)[0]
 
 
 def extract_elevation_fom(byte_array):
@@ -629,11 +679,23 @@ def extract_cir(byte_array):
 
 
 def extract_pdoa1(byte_array):
-    return int((byte_array[67] << 8) + byte_array[66])
+    return UINT16_LE.unpack_from(byte_array, 66)[0]
 
 
 def extract_pdoa2(byte_array):
-    return int((byte_array[71] << 8) + byte_array[70])
+    return UINT16_LE.unpack_from(byte_array, 70)[0]
+
+
+# RANGE_DATA_NTF fields at fixed payload offsets, decoded in one C call:
+# seq_cnt @0, nlos @28, distance @29, azimuth @31, azimuth_fom @33, elevation @34, elevation_fom @36
+# Angles and PDoA are signed Q9.7, so "h" already does the 2's complement
+RANGE_NTF_STRUCT = struct.Struct("<I24xBHhBhB")
+# Same fields plus pdoa1 @66 and pdoa2 @70, for payloads longer than 71 bytes,
+# so a PDoA-carrying notification is still a single unpack
+RANGE_NTF_PDOA_STRUCT = struct.Struct("<I24xBHhBhB29xh2xh")
+
+# Scale of a signed Q9.7 value already sign-extended (e.g. by an int16 decode)
+Q9_7_SCALE = 1.0 / (1 << 7)
 
 
 def twos_comp(val, bits):
@@ -672,24 +734,25 @@ def write_to_serial_port():
         if (retry_cmd):
             retry_cmd = False
         else:
-            uci_command = command_queue.get()
+            while (not command_queue):
+                command_event.wait()
+                command_event.clear()
+            uci_command = command_queue.popleft()
 
-        if (uci_command[0] == 0xFF and uci_command[1] == 0xFF):
+        if (uci_command == END_OF_WRITE):
             break
 
-        usb_out_packet = bytearray()
-        usb_out_packet.append(0x01)
-        usb_out_packet.append(0x00)
-        usb_out_packet.append(len(uci_command))
-        usb_out_packet.extend(uci_command)
+        # Commands in the queue are already framed bytes (see _frame); GID/OID follow the USB header
+        gid = uci_command[FRAME_HDR_LEN]
+        oid = uci_command[FRAME_HDR_LEN + 1]
 
-        if (uci_command[0] == 0x21 and uci_command[1] == 0x03):
+        if (gid == 0x21 and oid == 0x03):
             # Wait Session State Initialized to send APP Configs
             session_status.allow_config.wait()
-        if (uci_command[0] == 0x22 and uci_command[1] == 0x00):
+        if (gid == 0x22 and oid == 0x00):
             # Wait Session State Idle to start ranging
             session_status.allow_start.wait()
-        if (uci_command[0] == 0x22 and uci_command[1] == 0x01):
+        if (gid == 0x22 and oid == 0x01):
             # Wait Session State Activated
             session_status.allow_stop.wait()
             # Wait reach limit of measurements to stop ranging
@@ -703,7 +766,7 @@ def write_to_serial_port():
             # else:
             #     output("NXPUCIX => " + "".join("{:02x} ".format(x) for x in uci_command))
 
-            serial_port.write(serial.to_bytes(usb_out_packet))
+            serial_port.write(uci_command)
 
             # stop_write_thread = True
             
@@ -745,6 +808,43 @@ UWB_SESSION_SET_INITIATOR_CONFIG_2 = [0x21, 0x03, 0x00, 0x13] + SESSION_ID + [
                                     0x11, 0x01, 0x01  # DEVICE_ROLE: Initiator
                                     ]
 
+# Add the USB framing (0x01 0x00 len) in front of a UCI command and freeze it as bytes
+def _frame(cmd):
+    b = bytes(cmd)
+    return b'\x01\x00' + bytes([len(b)]) + b
+
+
+# Every command is framed once here, so the write thread hands bytes straight to the port
+FRAME_HDR_LEN = 3  # GID/OID of a framed command are at [3] and [4]
+END_OF_WRITE = b'\xff\xff'  # Sentinel, never sent
+UWB_GET_DEVICE_INFO_FRAMED = _frame([0x20, 0x02, 0x00, 0x00])
+UWB_GET_DEVICE_CAPS_FRAMED = _frame([0x20, 0x03, 0x00, 0x00])
+UWB_SET_BOARD_VARIANT_FRAMED = _frame(UWB_SET_BOARD_VARIANT)
+UWB_RESET_DEVICE_FRAMED = _frame(UWB_RESET_DEVICE)
+UWB_CORE_SET_CONFIG_FRAMED = _frame(UWB_CORE_SET_CONFIG)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH5_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH5)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH5_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH5)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH9_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH9)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH9_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH9)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_AVG_PDOA_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_AVG_PDOA)
+UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_TH_PDOA_FRAMED = _frame(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_TH_PDOA)
+UWB_SET_CALIBRATION_FRAMED = _frame(UWB_SET_CALIBRATION)
+UWB_SET_PDOA1_CALIBRATION_FRAMED = _frame(UWB_SET_PDOA1_CALIBRATION)
+UWB_SET_PDOA2_CALIBRATION_FRAMED = _frame(UWB_SET_PDOA2_CALIBRATION)
+UWB_SESSION_INIT_RANGING_FRAMED = _frame(UWB_SESSION_INIT_RANGING)
+UWB_SESSION_SET_APP_CONFIG_FRAMED = _frame(UWB_SESSION_SET_APP_CONFIG)
+UWB_SESSION_SET_INITIATOR_CONFIG_FRAMED = _frame(UWB_SESSION_SET_INITIATOR_CONFIG)
+UWB_SESSION_SET_RESPONDER_CONFIG_FRAMED = _frame(UWB_SESSION_SET_RESPONDER_CONFIG)
+UWB_SESSION_SET_DEBUG_CONFIG_FRAMED = _frame(UWB_SESSION_SET_DEBUG_CONFIG)
+UWB_RANGE_START_FRAMED = _frame(UWB_RANGE_START)
+UWB_RANGE_STOP_FRAMED = _frame(UWB_RANGE_STOP)
+UWB_SESSION_DEINIT_FRAMED = _frame(UWB_SESSION_DEINIT)
+UWB_SESSION_SET_RESPONDER_CONFIG_1_FRAMED = _frame(UWB_SESSION_SET_RESPONDER_CONFIG_1)
+UWB_SESSION_SET_RESPONDER_CONFIG_2_FRAMED = _frame(UWB_SESSION_SET_RESPONDER_CONFIG_2)
+UWB_SESSION_SET_INITIATOR_CONFIG_1_FRAMED = _frame(UWB_SESSION_SET_INITIATOR_CONFIG_1)
+UWB_SESSION_SET_INITIATOR_CONFIG_2_FRAMED = _frame(UWB_SESSION_SET_INITIATOR_CONFIG_2)
+
+
 def change_state():
     global command_queue
     global current_state
@@ -768,19 +868,19 @@ def change_state():
     # command_queue.put(UWB_SET_PDOA1_CALIBRATION)
     # command_queue.put(UWB_SET_PDOA2_CALIBRATION)
 
-    command_queue.put(UWB_SESSION_DEINIT)
-    command_queue.put(UWB_SESSION_INIT_RANGING)
-    command_queue.put(UWB_SESSION_SET_APP_CONFIG)
+    enqueue_command(UWB_SESSION_DEINIT_FRAMED)
+    enqueue_command(UWB_SESSION_INIT_RANGING_FRAMED)
+    enqueue_command(UWB_SESSION_SET_APP_CONFIG_FRAMED)
     if(current_state==1):
         # if (rhodes_role == "Initiator"): command_queue.put(UWB_SESSION_SET_INITIATOR_CONFIG_2)
         # if (rhodes_role == "Responder"): command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG_2)
-        command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG_2)
+        enqueue_command(UWB_SESSION_SET_RESPONDER_CONFIG_2_FRAMED)
         current_state = 2
         print("State 2")
     elif(current_state==2):
         # if (rhodes_role == "Initiator"): command_queue.put(UWB_SESSION_SET_INITIATOR_CONFIG_1)
         # if (rhodes_role == "Responder"): command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG_1)
-        command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG_1)
+        enqueue_command(UWB_SESSION_SET_RESPONDER_CONFIG_1_FRAMED)
         current_state = 1
         print("State 1")
     # elif(current_state==3):
@@ -789,7 +889,7 @@ def change_state():
     #     # command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG_1)
     #     current_state = 1
     #     print("State 2")
-    command_queue.put(UWB_RANGE_START)
+    enqueue_command(UWB_RANGE_START_FRAMED)
 
 
 def read_from_serial_port():
@@ -811,6 +911,8 @@ def read_from_serial_port():
     global range_plot
     global is_ipc
     global socket
+    global range_queue
+    global meas_sock
 
     meas_nlos = 0
     meas_distance = 0
@@ -821,117 +923,117 @@ def read_from_serial_port():
     meas_pdoa1 = 0
     meas_pdoa2 = 0
     avg_window_size = 5
-    hist_distance = []
-    hist_azimuth = []
-    hist_elevation = []
-    hist_pdoa1 = []
-    hist_pdoa2 = []
+    # One ring buffer for the five channels (distance, azimuth, elevation, pdoa1, pdoa2)
+    # with a running sum per channel: O(1) per sample, all averages in one operation.
+    # float64 so the add/subtract running sum does not drift over long sessions.
+    hist = np.zeros((avg_window_size, 5), dtype=np.float64)
+    hist_sum = np.zeros(5, dtype=np.float64)
+    hist_idx = 0
+    hist_len = 0
     is_stored = False
 
     output("Read from serial port started")
+    rx_buf = bytearray()  # Received bytes not yet split into UCI frames
     while (not stop_read_thread):
         if serial_port.isOpen():
-            if serial_port.isOpen():
-                uci_hdr = serial_port.read(4)  # Read header of UCI frame
+            # One read for everything already waiting (blocks up to the timeout for the first byte)
+            rx_buf += serial_port.read(max(1, serial_port.in_waiting))
+
+            # Dispatch every complete UCI frame in the buffer, keep a partial one for the next read
+            while len(rx_buf) >= 4:
+                count = rx_buf[3]
+                if (rx_buf[1] & 0x80) == 0x80:
+                    # Extended length
+                    count = (rx_buf[3] << 8) + rx_buf[2]
+                frame_len = 4 + count
+                if len(rx_buf) < frame_len:
+                    break
+                uci_hdr = bytes(rx_buf[:4])
+                uci_payload = bytes(rx_buf[4:frame_len])
+                del rx_buf[:frame_len]
+
                 write_wait.acquire()  # Acquire Lock to avoid mixing in output
-                if len(uci_hdr) == 4:
-                    count = uci_hdr[3]
-                    if (uci_hdr[1] & 0x80) == 0x80:
-                        # Extended length
-                        count = int((uci_hdr[3] << 8) + uci_hdr[2])
-                    if count > 0:
-                        if serial_port.isOpen():
-                            uci_payload = serial_port.read(count)  # Read payload of UCI frame
-
-                            # if (is_timestamp):
-                            #     is_stored = output(datetime.now().isoformat(sep=" ", timespec="milliseconds") + \
-                            #                        "NXPUCIR <= " + "".join("{:02x} ".format(h) for h in uci_hdr) + \
-                            #                        "".join("{:02x} ".format(p) for p in uci_payload))
-                            # else:
-                            #     is_stored = output("NXPUCIR <= " + "".join("{:02x} ".format(h) for h in uci_hdr) + \
-                            #                        "".join("{:02x} ".format(p) for p in uci_payload))
-
-                            if len(uci_payload) == count:
-                                if (uci_hdr[0] & 0xF0) == 0x40: write_wait.notify()  # Notify the reception of RSP
-
-                                if (uci_hdr[0] == 0x60 and uci_hdr[1] == 0x07 and uci_hdr[3] == 0x01 and \
-                                        uci_payload[0] == 0x0A):
-                                    # Command retry without wait response
-                                    retry_cmd = True
-                                    write_wait.notify()
-
-                                if (uci_hdr[0] == 0x61 and uci_hdr[1] == 0x02 and uci_hdr[3] == 0x06):
-                                    # Change Session state
-                                    session_status.set(uci_payload[4])
-                                    if (uci_payload[5] == 0x01):
-                                        # Session termination on max RR Retry
-                                        go_stop.set()
-
-                                if (uci_hdr[0] == 0x62 and uci_hdr[1] == 0x00):
-                                    # RANGE_DATA_NTF
-                                    seq_cnt = extract_seq_cnt(uci_payload)
-                                    # Check Status
-                                    if (uci_payload[27] != 0x00):
-                                        output("***** Ranging Error Detected ****")
-                                    else:
-                                        meas_nlos = (extract_nlos(uci_payload))
-                                        meas_distance = (extract_distance(uci_payload))
-                                        meas_azimuth = convert_qformat_to_float(extract_azimuth(uci_payload), 9, 7, 1)
-                                        meas_azimuth_fom = (extract_azimuth_fom(uci_payload))
-                                        meas_elevation = convert_qformat_to_float(extract_elevation(uci_payload), 9, 7,
-                                                                                  1)
-                                        meas_elevation_fom = (extract_elevation_fom(uci_payload))
-
-                                        # added by maya, 20210618
-                                        if (len(uci_payload) > 71):
-                                            meas_pdoa1 = convert_qformat_to_float(extract_pdoa1(uci_payload), 9, 7, 7)
-                                            meas_pdoa2 = convert_qformat_to_float(extract_pdoa2(uci_payload), 9, 7, 7)
-
-                                        hist_distance.append(meas_distance)
-                                        hist_azimuth.append(meas_azimuth)
-                                        hist_elevation.append(meas_elevation)
-                                        hist_pdoa1.append(meas_pdoa1)
-                                        hist_pdoa2.append(meas_pdoa2)
-
-                                        if (len(hist_distance) > avg_window_size): hist_distance.pop(0)
-                                        if (len(hist_azimuth) > avg_window_size): hist_azimuth.pop(0)
-                                        if (len(hist_elevation) > avg_window_size): hist_elevation.pop(0)
-                                        if (len(hist_pdoa1) > avg_window_size): hist_pdoa1.pop(0)
-                                        if (len(hist_pdoa2) > avg_window_size): hist_pdoa2.pop(0)
-
-                                        avg_distance = sum(hist_distance) / len(hist_distance)
-                                        avg_azimuth = sum(hist_azimuth) / len(hist_azimuth)
-                                        avg_elevation = sum(hist_elevation) / len(hist_elevation)
-                                        avg_pdoa1 = sum(hist_pdoa1) / len(hist_pdoa1)
-                                        avg_pdoa2 = sum(hist_pdoa2) / len(hist_pdoa2)
-                                        output(
-                                            "***(%d) NLos:%d   Dist:%d   Azimuth:%f (FOM:%d)   Elevation:%f (FOM:%d)  PDoA1:%f   PDoA2:%f" \
-                                            % (seq_cnt, meas_nlos, meas_distance, meas_azimuth, meas_azimuth_fom,
-                                               meas_elevation, meas_elevation_fom, meas_pdoa1, meas_pdoa2))
-                                        # output(
-                                        #     "*** Avg Dist:%d   Avg Azimuth:%f   Avg Elevation:%f   Avg_PDoA1:%f   Avg_PDoA2:%f" \
-                                        #     % (avg_distance, avg_azimuth, avg_elevation, avg_pdoa1, avg_pdoa2))
-
-
-                                        if ((not is_ipc) or (is_stored)):
-                                            # Increment the number of valid measurements
-                                            meas_idx += 1
-
-                                        if (nb_meas > 0 and meas_idx > nb_meas):
-                                            go_stop.set()
-                                    change_state()
-                            else:
-                                output("\nExpected Payload bytes is " + str(count) + \
-                                       ", Actual Paylod bytes received is " + str(len(uci_payload)))
+                if count > 0:
+                    if (uci_hdr[0] & 0xF0) == 0x40: write_wait.notify()  # Notify the reception of RSP
+
+                    if (uci_hdr[0] == 0x60 and uci_hdr[1] == 0x07 and uci_hdr[3] == 0x01 and \
+                            uci_payload[0] == 0x0A):
+                        # Command retry without wait response
+                        retry_cmd = True
+                        write_wait.notify()
+
+                    if (uci_hdr[0] == 0x61 and uci_hdr[1] == 0x02 and uci_hdr[3] == 0x06):
+                        # Change Session state
+                        session_status.set(uci_payload[4])
+                        if (uci_payload[5] == 0x01):
+                            # Session termination on max RR Retry
+                            go_stop.set()
+
+                    if (uci_hdr[0] == 0x62 and uci_hdr[1] == 0x00):
+                        # RANGE_DATA_NTF
+                        # Check Status
+                        if (uci_payload[27] != 0x00):
+                            output("***** Ranging Error Detected ****")
                         else:
-                            output("Port is not opened")
-                    else:
-                        output("\nUCI Payload Size is Zero")
+                            # All fields in one unpack; angles and PDoA come out sign-extended
+                            # added by maya, 20210618 (PDoA)
+                            if (len(uci_payload) > 71):
+                                (seq_cnt, meas_nlos, meas_distance, raw_azimuth, meas_azimuth_fom,
+                                 raw_elevation, meas_elevation_fom, raw_pdoa1, raw_pdoa2) = \
+                                    RANGE_NTF_PDOA_STRUCT.unpack_from(uci_payload)
+                                # Q9.7 is exact at 7 decimals, no rounding needed
+                                meas_pdoa1 = raw_pdoa1 * Q9_7_SCALE
+                                meas_pdoa2 = raw_pdoa2 * Q9_7_SCALE
+                            else:
+                                (seq_cnt, meas_nlos, meas_distance, raw_azimuth, meas_azimuth_fom,
+                                 raw_elevation, meas_elevation_fom) = RANGE_NTF_STRUCT.unpack_from(uci_payload)
+                            meas_azimuth = round(raw_azimuth * Q9_7_SCALE, 1)
+                            meas_elevation = round(raw_elevation * Q9_7_SCALE, 1)
+
+                            # Overwrite the oldest row (zeros until the window fills) and update the sums
+                            row = hist[hist_idx]
+                            hist_sum -= row
+                            row[:] = (meas_distance, meas_azimuth, meas_elevation, meas_pdoa1, meas_pdoa2)
+                            hist_sum += row
+                            hist_idx = (hist_idx + 1) % avg_window_size
+                            if (hist_len < avg_window_size): hist_len += 1
+
+                            avg_distance, avg_azimuth, avg_elevation, avg_pdoa1, avg_pdoa2 = hist_sum / hist_len
+                            if (meas_sock is not None):
+                                # Binary datagram, no text formatting or parsing on either side
+                                try:
+                                    meas_sock.send(MEAS_STRUCT.pack(seq_cnt, meas_nlos, meas_distance,
+                                                                    meas_azimuth, meas_elevation))
+                                except BlockingIOError:
+                                    pass  # Reader's queue is full; drop this measurement
+                                except OSError:
+                                    pass  # Reader gone; drop this measurement
+                            else:
+                                output(
+                                    "***(%d) NLos:%d   Dist:%d   Azimuth:%f (FOM:%d)   Elevation:%f (FOM:%d)  PDoA1:%f   PDoA2:%f" \
+                                    % (seq_cnt, meas_nlos, meas_distance, meas_azimuth, meas_azimuth_fom,
+                                       meas_elevation, meas_elevation_fom, meas_pdoa1, meas_pdoa2))
+                            if (range_queue is not None):
+                                try:
+                                    range_queue.put_nowait((seq_cnt, meas_distance, meas_azimuth,
+                                                            meas_elevation, meas_nlos))
+                                except Full:
+                                    pass  # Consumer is behind; drop rather than stall the serial read
+                            # output(
+                            #     "*** Avg Dist:%d   Avg Azimuth:%f   Avg Elevation:%f   Avg_PDoA1:%f   Avg_PDoA2:%f" \
+                            #     % (avg_distance, avg_azimuth, avg_elevation, avg_pdoa1, avg_pdoa2))
+
+
+                            if ((not is_ipc) or (is_stored)):
+                                # Increment the number of valid measurements
+                                meas_idx += 1
+
+                            if (nb_meas > 0 and meas_idx > nb_meas):
+                                go_stop.set()
+                        change_state()
                 else:
-                    output("\nUCI Header is not valid")
+                    output("\nUCI Payload Size is Zero")
                 write_wait.release()
-            else:
-                output("Port is not opened (2)")
         else:
             output("Port is not opened (1)")
 
@@ -947,6 +1049,7 @@ def serial_port_configure():
     serial_port.port = com_port
 
 
+# Raise on failure so callers of run() (often in a worker thread) can see it
 def open_serial_port():
     global serial_port
     if serial_port.isOpen(): serial_port.close()
@@ -954,7 +1057,7 @@ def open_serial_port():
         serial_port.open()
     except:
         output("#=> Fail to open " + com_port)
-        sys.exit(1)
+        raise
 
 
 def start_processing():
@@ -987,16 +1090,25 @@ def start_processing():
     # session_status.allow_end.set()
 
     # while (session_status.allow_end.is_set() == False):
-    while(1):
+    # Sleep until Ctrl+C instead of spinning; wake every 5 s for the elapsed-time print
+    while (not handler.pressed.wait(5)):
         current_time = time.time()
-        if(current_time-start_time>=5):
-            print("Time elapsed since reset = " + str(current_time-start_time))
-            start_time = time.time()
-            # change_state()
+        print("Time elapsed since reset = " + str(current_time-start_time))
+        start_time = time.time()
+        # change_state()
+
+    stop_processing()
+
+
+def stop_processing():
+    global stop_ipc_thread
+    global stop_read_thread
+    global stop_write_thread
+    global session_status
+    global is_ipc
+    global command_queue
+    global go_stop
 
-        if handler.sigint:
-            break
-    
     # To restore output on STDOUT
     is_ipc = False
 
@@ -1006,7 +1118,7 @@ def start_processing():
     stop_ipc_thread = True
 
     # Unblock the waiting in the write thread
-    command_queue.put([0xFF, 0xFF])  # End of write
+    enqueue_command(END_OF_WRITE)  # End of write
     session_status.set_all()
     go_stop.set()
 
@@ -1034,7 +1146,8 @@ def reset_stuff():
     # serial_port = serial.Serial()
     open_serial_port()
 
-    command_queue = queue.Queue(maxsize=100)
+    command_queue.clear()
+    command_event.clear()
     session_status.clear_all()
     go_stop.clear()
 
@@ -1052,6 +1165,77 @@ def reset_stuff():
     # file_ipc = None
     # socket = None
 
+
+def queue_session_commands():
+    global command_queue
+    global rhodes_role
+    global nb_meas
+
+    output("Start adding commands to the queue...")
+    enqueue_command(UWB_SET_BOARD_VARIANT_FRAMED)
+    enqueue_command(UWB_RESET_DEVICE_FRAMED)
+    enqueue_command(UWB_GET_DEVICE_INFO_FRAMED)  # Get Device Information
+    enqueue_command(UWB_GET_DEVICE_CAPS_FRAMED)  # Get Device Capability
+
+    enqueue_command(UWB_CORE_SET_CONFIG_FRAMED)
+    enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH5_FRAMED)
+    enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH5_FRAMED)
+    enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH9_FRAMED)
+    enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH9_FRAMED)
+    enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_AVG_PDOA_FRAMED)
+    enqueue_command(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_TH_PDOA_FRAMED)
+    enqueue_command(UWB_SET_CALIBRATION_FRAMED)
+    enqueue_command(UWB_SET_PDOA1_CALIBRATION_FRAMED)
+    enqueue_command(UWB_SET_PDOA2_CALIBRATION_FRAMED)
+
+    enqueue_command(UWB_SESSION_INIT_RANGING_FRAMED)
+    enqueue_command(UWB_SESSION_SET_APP_CONFIG_FRAMED)
+    if (rhodes_role == "Initiator"): enqueue_command(UWB_SESSION_SET_INITIATOR_CONFIG_FRAMED)
+    if (rhodes_role == "Responder"): enqueue_command(UWB_SESSION_SET_RESPONDER_CONFIG_FRAMED)
+    enqueue_command(UWB_SESSION_SET_DEBUG_CONFIG_FRAMED)
+
+    enqueue_command(UWB_RANGE_START_FRAMED)
+    if (nb_meas > 0):
+        enqueue_command(UWB_RANGE_STOP_FRAMED)
+        enqueue_command(UWB_SESSION_DEINIT_FRAMED)
+    output("adding commands to the queue completed")
+
+
+def run(role, port, stop_event, out_queue, meas=0):
+    """
+    Range in-process until stop_event is set, putting one
+    (seq_cnt, distance, azimuth, elevation, nlos) tuple per measurement on out_queue.
+    Lets other scripts import nxp instead of launching it and parsing its stdout.
+    Raises if the serial port cannot be opened; returns only once the read and
+    write threads have exited, so the next run() cannot revive them.
+    """
+    global rhodes_role
+    global com_port
+    global nb_meas
+    global range_queue
+
+    rhodes_role = role
+    com_port = port
+    nb_meas = meas
+    range_queue = out_queue
+
+    serial_port_configure()
+    reset_stuff()  # Open the port with a fresh command queue and session state
+    queue_session_commands()
+
+    read_thread = Thread(target=read_from_serial_port, args=())
+    read_thread.start()
+    write_thread = Thread(target=write_to_serial_port, args=())
+    write_thread.start()
+
+    stop_event.wait()
+
+    stop_processing()
+    write_thread.join()
+    read_thread.join()
+    range_queue = None
+
+
 def main():
     global nb_meas
     global rhodes_role
@@ -1064,6 +1248,8 @@ def main():
     global prefix_ipc
     global file_ipc
     global command_queue
+    global is_meas_sock
+    global meas_sock
 
     path = ""
 
@@ -1086,6 +1272,8 @@ def main():
             is_cir_plot = False
         elif (arg == "ipc"):
             is_ipc = True
+        elif (arg == "sock"):
+            is_meas_sock = True
         else:
             path = arg
 
@@ -1096,6 +1284,9 @@ def main():
         is_timestamp) + \
            "   Range Plot:" + str(is_range_plot) + "   CIR Plot:" + str(is_cir_plot) + "   IPC:" + str(is_ipc))
 
+    if (is_meas_sock):
+        meas_sock = open_meas_socket(MEAS_SOCK_PATH)
+
     output("Configure serial port...")
     serial_port_configure()
     output("Serial port configured")
@@ -1105,38 +1296,13 @@ def main():
     if(repeat_this):
         # reset_stuff()
 
-        open_serial_port()
+        try:
+            open_serial_port()
+        except Exception:
+            sys.exit(1)
 
         # Add the UCI Commands to sent
-        output("Start adding commands to the queue...")
-        command_queue.put(UWB_SET_BOARD_VARIANT)
-        command_queue.put(UWB_RESET_DEVICE)
-        command_queue.put([0x20, 0x02, 0x00, 0x00])  # Get Device Information
-        command_queue.put([0x20, 0x03, 0x00, 0x00])  # Get Device Capability
-
-        command_queue.put(UWB_CORE_SET_CONFIG)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH5)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH5)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_1_CH9)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_RX_ANT_PAIR_2_CH9)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_AVG_PDOA)
-        command_queue.put(UWB_CORE_SET_CONFIG_AOA_CALIB_CTRL_TH_PDOA)
-        command_queue.put(UWB_SET_CALIBRATION)
-        command_queue.put(UWB_SET_PDOA1_CALIBRATION)
-        command_queue.put(UWB_SET_PDOA2_CALIBRATION)
-
-        command_queue.put(UWB_SESSION_INIT_RANGING)
-        command_queue.put(UWB_SESSION_SET_APP_CONFIG)
-        if (rhodes_role == "Initiator"): command_queue.put(UWB_SESSION_SET_INITIATOR_CONFIG)
-        if (rhodes_role == "Responder"): command_queue.put(UWB_SESSION_SET_RESPONDER_CONFIG)
-        command_queue.put(UWB_SESSION_SET_DEBUG_CONFIG)
-
-        command_queue.put(UWB_RANGE_START)
-        if (nb_meas > 0):
-            command_queue.put(UWB_RANGE_STOP)
-            command_queue.put(UWB_SESSION_DEINIT)
-        output("adding commands to the queue completed")
-
+        queue_session_commands()
 
         # start_time = time.time()
         output("Start processing...")
@@ -1,104 +1,172 @@
-import subprocess
 import csv
-import re
+import os
+import queue
+import struct
+import sys
+import threading
 import time
-from datetime import datetime
+
+import nxp
 
 # =================CONFIGURATION=================
-UWB_COMMAND = ["python", "-u", "nxp.py", "i", "100", "/dev/ttyUSB0"]  # Change port if needed
+UWB_ROLE = "Initiator"
+UWB_PORT = "/dev/ttyUSB0"  # Change port if needed
+UWB_NB_MEAS = 100  # measurements before nxp stops the session (0: no stop)
 OUTPUT_FILE = "uwb_data.csv"
-RUN_WINDOW_SEC = 5  # run nxp.py for 5 seconds each cycle
+RUN_WINDOW_SEC = 5  # range for 5 seconds each cycle
+CSV_FLUSH_ROWS = 128  # buffered rows written to the CSV in one call
+CSV_FLUSH_SEC = 0.5   # write buffered rows at least this often
+MEAS_QUEUE_LEN = 1024  # measurements waiting for this loop; nxp drops new ones when full
+# Log packed binary records instead of CSV (no text formatting while ranging);
+# convert afterwards with: python uwbtest.py tocsv
+BINARY_LOG = False
+BINARY_LOG_FILE = "uwb_data.bin"
 # ===============================================
 
+# One binary log record: time_ns, distance_cm, azimuth_deg, elevation_deg, nlos
+UWB_RECORD = struct.Struct("<QHddB")  # float64 so converted CSV values match a direct CSV log
+CSV_HEADER = ["Timestamp", "Distance_cm", "Azimuth_deg", "Elevation_deg", "NLoS_Status"]
+
+
+def format_clock_ns(ns):
+    """Format epoch nanoseconds as local HH:MM:SS.ffffff."""
+    sec, ns = divmod(ns, 1_000_000_000)
+    return f"{time.strftime('%H:%M:%S', time.localtime(sec))}.{ns // 1000:06d}"
+
+
+def write_rows(writer, rows):
+    """Write buffered rows, formatting their ns timestamps only now."""
+    writer.writerows((format_clock_ns(ts_ns), *rest) for ts_ns, *rest in rows)
+
+
+def write_records(fd, rows):
+    """Append buffered rows to the binary log with a single os.write."""
+    pack = UWB_RECORD.pack
+    os.write(fd, b"".join([pack(*row) for row in rows]))
+
 
-def run_uwb_once(writer, data_pattern, csv_file):
+def run_uwb_once(write_batch):
     """
-    Run nxp.py once for RUN_WINDOW_SEC seconds,
-    log any parsed lines to CSV, then stop.
+    Run nxp ranging in-process for RUN_WINDOW_SEC seconds,
+    hand every measurement to write_batch in batches, then stop.
     """
-    print(f"\n[+] Starting UWB script: {' '.join(UWB_COMMAND)}")
-    process = subprocess.Popen(
-        UWB_COMMAND,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1  # line-buffered
-    )
+    print(f"\n[+] Starting UWB ranging: {UWB_ROLE} on {UWB_PORT}")
+    stop_event = threading.Event()
+    measurements = queue.Queue(maxsize=MEAS_QUEUE_LEN)
+    errors = []  # exception raised by nxp.run, re-raised here once the thread is done
+
+    def ranging():
+        try:
+            nxp.run(UWB_ROLE, UWB_PORT, stop_event, measurements, UWB_NB_MEAS)
+        except Exception as e:
+            errors.append(e)
+
+    uwb_thread = threading.Thread(target=ranging, daemon=True)
+    uwb_thread.start()
 
     start_time = time.time()
+    last_flush = start_time
+    rows = []  # (time_ns, dist, azimuth, elevation, nlos) rows not yet written
 
     try:
         while True:
+            now = time.time()
+
+            # Write buffered rows in one batch (count or age based)
+            if rows and (len(rows) >= CSV_FLUSH_ROWS or now - last_flush >= CSV_FLUSH_SEC):
+                write_batch(rows)
+                rows.clear()
+                last_flush = now
+
             # Stop after RUN_WINDOW_SEC seconds
-            if time.time() - start_time >= RUN_WINDOW_SEC:
-                print(f"[i] {RUN_WINDOW_SEC}s window elapsed, restarting nxp.py...")
+            remaining = RUN_WINDOW_SEC - (now - start_time)
+            if remaining <= 0:
+                print(f"[i] {RUN_WINDOW_SEC}s window elapsed, restarting ranging...")
+                break
+
+            if not uwb_thread.is_alive():
+                print("[!] nxp ranging stopped before time window finished.")
                 break
 
-            line = process.stdout.readline()
-
-            # If the process has exited and there's no more output
-            if not line:
-                if process.poll() is not None:
-                    print("[!] nxp.py exited before time window finished.")
-                    err = process.stderr.read()
-                    if err:
-                        print("Error details:\n", err)
-                    break
-                # No line yet but still running — avoid busy spinning
-                time.sleep(0.01)
+            try:
+                seq_cnt, dist, azimuth, elevation, nlos = measurements.get(
+                    timeout=min(remaining, CSV_FLUSH_SEC))
+            except queue.Empty:
                 continue
 
-            # Show raw output
-            print(line.strip())
+            # Raw ns clock per sample; formatted (if at all) once per batch
+            rows.append((time.time_ns(), dist, azimuth, elevation, nlos))
 
-            # Parse line using regex
-            match = data_pattern.search(line)
-            if match:
-                timestamp = datetime.now().strftime("%H:%M:%S.%f")
-                nlos = match.group(1)      # Non-Line-of-Sight flag
-                dist = match.group(2)      # Distance in cm
-                azimuth = match.group(3)   # Angle
-                elevation = match.group(4) # Height angle
+    finally:
+        # Stop ranging for this window (replaces terminating the old subprocess)
+        stop_event.set()
+        # No timeout: the next cycle resets nxp state its read/write threads share
+        uwb_thread.join()
 
-                # Write to CSV and flush
-                writer.writerow([timestamp, dist, azimuth, elevation, nlos])
-                csv_file.flush()
+        # Write whatever is left from this window
+        if rows:
+            write_batch(rows)
+        print("[i] nxp ranging stopped for this cycle.")
+
+    if errors:
+        raise errors[0]  # e.g. the serial port could not be opened; don't spin on it
+
+
+def log_uwb_binary():
+    print(f"Logging binary records to: {BINARY_LOG_FILE}")
+    print("Press Ctrl+C to stop logging.\n")
 
+    # Unbuffered append-only file: each batch is one write() syscall, no Python file layer
+    fd = os.open(BINARY_LOG_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        while True:
+            run_uwb_once(lambda rows: write_records(fd, rows))
+    except KeyboardInterrupt:
+        print("\n[!] Stopping logger...")
     finally:
-        # Ensure the process is stopped at the end of this window
-        try:
-            process.terminate()
-        except Exception:
-            pass
-        try:
-            process.wait(timeout=1)
-        except Exception:
-            pass
-        print("[i] nxp.py process terminated for this cycle.")
+        os.fsync(fd)
+        os.close(fd)
+
+
+def binary_to_csv(bin_path=BINARY_LOG_FILE, csv_path=OUTPUT_FILE):
+    """Convert a binary log written by log_uwb_binary to the usual CSV."""
+    with open(bin_path, "rb") as f:
+        data = f.read()
+    usable = len(data) - len(data) % UWB_RECORD.size  # ignore a torn last record
+    with open(csv_path, mode='w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(CSV_HEADER)
+        write_rows(writer, UWB_RECORD.iter_unpack(data[:usable]))
+    print(f"Wrote {usable // UWB_RECORD.size} rows to {csv_path}")
 
 
 def log_uwb_data():
+    if BINARY_LOG:
+        log_uwb_binary()
+        return
+
     print(f"Logging data to: {OUTPUT_FILE}")
     print("Press Ctrl+C to stop logging.\n")
 
-    # Compile regex once
-    data_pattern = re.compile(
-        r"NLos:(\d+).*Dist:(\d+).*Azimuth:([-\d\.]+).*Elevation:([-\d\.]+)"
-    )
-
     # Open the CSV file once and keep reusing it
     with open(OUTPUT_FILE, mode='w', newline='') as csv_file:
         writer = csv.writer(csv_file)
         # Header columns
-        writer.writerow(["Timestamp", "Distance_cm", "Azimuth_deg", "Elevation_deg", "NLoS_Status"])
+        writer.writerow(CSV_HEADER)
 
         try:
-            # Continuous cycles: each cycle runs nxp.py for RUN_WINDOW_SEC seconds
+            # Continuous cycles: each cycle ranges for RUN_WINDOW_SEC seconds
             while True:
-                run_uwb_once(writer, data_pattern, csv_file)
+                run_uwb_once(lambda rows: write_rows(writer, rows))
+                csv_file.flush()
         except KeyboardInterrupt:
             print("\n[!] Stopping logger...")
+            csv_file.flush()
+            os.fsync(csv_file.fileno())
 
 
 if __name__ == "__main__":
-    log_uwb_data()
+    if sys.argv[1:2] == ["tocsv"]:
+        binary_to_csv()
+    else:
+        log_uwb_data()
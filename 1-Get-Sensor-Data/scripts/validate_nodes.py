@@ -3,11 +3,12 @@ import threading
 import time
 import csv
 import re
-import cv2
+import io
+import socket
+import struct
 import pandas as pd
-from datetime import datetime
 import queue
-from picamera.array import PiRGBArray
+from collections import deque, namedtuple
 from picamera import PiCamera
 
 # ==========================================
@@ -15,82 +16,150 @@ from picamera import PiCamera
 # ==========================================
 UWB_SCRIPT_PATH = "nxp.py"
 UWB_COM_PORT = "/dev/ttyUSB0"  # Change to your actual port (e.g., /dev/ttyUSB0 on Linux)
+UWB_SOCK_PATH = "/tmp/uwb.sock"  # Must match MEAS_SOCK_PATH in nxp.py
 OUTPUT_CSV = "sensor_fusion_data.csv"
 IMAGE_FOLDER = "captured_images"
+JPEG_QUALITY = 80  # Hardware JPEG encoder quality (lower = smaller files, faster writes)
+IMAGE_QUEUE_SIZE = 8  # Encoded frames waiting for the disk writer; frames are dropped when full
+CSV_FLUSH_ROWS = 50  # Logger rows buffered before one batched write (~5 s of rows)
+LOG_MAX_INTERVAL = 0.1  # Log a row at least this often even when no new UWB sample arrives
+FRAME_WAIT_SEC = 0.1    # How long a row waits for the frame it requested (~3 frames at 30 fps)
 
 # Create image folder if it doesn't exist
 import os
 if not os.path.exists(IMAGE_FOLDER):
     os.makedirs(IMAGE_FOLDER)
 
-# Global variables to hold the latest data from each sensor
-latest_data = {
-    "timestamp": None,
-    "uwb_dist": None,
-    "uwb_azimuth": None,
-    "uwb_elevation": None,
-    "imu_acc_x": 0, "imu_acc_y": 0, "imu_acc_z": 0,
-    "imu_gyro_x": 0, "imu_gyro_y": 0, "imu_gyro_z": 0,
-    "image_filename": None
-}
-
-# Thread locking to prevent reading data while it's being written
-data_lock = threading.Lock()
+# Latest reading from each sensor. Each worker appends one immutable tuple to its
+# own deque(maxlen=1); append and [-1] are single atomic operations under the GIL,
+# so the logger always sees a consistent snapshot without taking a lock.
+UwbSample = namedtuple("UwbSample", "dist azimuth elevation")
+ImuSample = namedtuple("ImuSample", "acc_x acc_y acc_z")
+
+NO_UWB = UwbSample(None, None, None)
+NO_IMU = ImuSample(0, 0, 0)
+
+latest_uwb = deque(maxlen=1)
+latest_imu = deque(maxlen=1)
+latest_img = deque(maxlen=1)  # image filename
+
+# Binary datagram sent by nxp.py in "sock" mode (MEAS_STRUCT there):
+# seq_cnt, nlos, distance (cm), azimuth, elevation (deg)
+UWB_MEAS_STRUCT = struct.Struct("<IBHff")
+
+# Ranging line printed by nxp.py (fallback when the socket is unavailable), compiled once.
+# Example: ***(105) NLos:0   Dist:250   Azimuth:12.500000 (FOM:1)   Elevation:5.000000 (FOM:1)...
+# Anchored with literal separators (no ".*") so a line is matched without backtracking.
+# Groups: NLoS, distance, azimuth, elevation
+UWB_LINE_PATTERN = re.compile(
+    r"\*\*\*\(\d+\) NLos:(\d+)\s+Dist:(\d+)\s+Azimuth:(-?\d+\.\d+)\s+\(FOM:\d+\)\s+Elevation:(-?\d+\.\d+)"
+)
+
 stop_event = threading.Event()
+# Set by the logger each tick; the camera only keeps (queues and writes) a frame when it is set,
+# so at most one image per logged row reaches the disk instead of every 30 fps frame
+capture_request = threading.Event()
+# Set by the camera once the requested frame's filename is in latest_img
+frame_ready = threading.Event()
+# Set by the UWB worker on every new measurement; wakes the logger so rows follow UWB arrivals
+uwb_fresh = threading.Event()
+
+# Encoded JPEGs (filename, bytes) handed from the camera thread to the disk writer
+image_queue = queue.Queue(maxsize=IMAGE_QUEUE_SIZE)
 
 # ==========================================
 # 1. UWB WORKER (Subprocess Wrapper)
 # ==========================================
 def uwb_worker():
     """
-    Runs the nxp.py script as a subprocess and parses its print output.
-    Looks for lines starting with *** to extract data.
+    Runs the nxp.py script as a subprocess and takes its measurements.
+    Measurements arrive as binary datagrams on UWB_SOCK_PATH; if that socket
+    cannot be created, falls back to parsing the *** lines nxp.py prints.
     """
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        if os.path.exists(UWB_SOCK_PATH):
+            os.unlink(UWB_SOCK_PATH)
+        sock.bind(UWB_SOCK_PATH)  # Bound before nxp.py starts so it can connect
+    except (OSError, AttributeError) as e:
+        print(f"[UWB] Socket unavailable ({e}), parsing nxp.py output instead.")
+        sock = None
+
     # Command to run the existing script. Add arguments if needed.
     cmd = ["python", UWB_SCRIPT_PATH, "r", UWB_COM_PORT]
+    if sock is not None:
+        cmd.append("sock")
     
     print(f"[UWB] Starting UWB subprocess: {' '.join(cmd)}")
     
-    # Start the subprocess with pipes for stdout
+    # Start the subprocess; stdout is only read in the fallback mode
     process = subprocess.Popen(
         cmd, 
-        stdout=subprocess.PIPE, 
+        stdout=subprocess.PIPE if sock is None else subprocess.DEVNULL,
         stderr=subprocess.PIPE, 
         text=True, 
         bufsize=1
     )
 
-    # Regex to parse the specific output line from nxp.py
-    # Example: ***(105) NLos:0 Dist:250 Azimuth:12.5 (FOM:1) Elevation:5.0 (FOM:1)...
-    pattern = re.compile(r"\*\*\*.*Dist:(\d+).*Azimuth:([-\d\.]+).*Elevation:([-\d\.]+)")
-
     try:
-        while not stop_event.is_set():
-            line = process.stdout.readline()
-            if not line:
-                break
-            
-            # Check if this line contains our data
-            match = pattern.search(line)
-            if match:
-                dist = int(match.group(1))
-                azimuth = float(match.group(2))
-                elevation = float(match.group(3))
-                
-                with data_lock:
-                    latest_data["uwb_dist"] = dist
-                    latest_data["uwb_azimuth"] = azimuth
-                    latest_data["uwb_elevation"] = elevation
-            
-            # Optional: Print raw line for debug
-            # print(f"[UWB RAW] {line.strip()}")
+        if sock is not None:
+            uwb_from_socket(sock, process)
+        else:
+            uwb_from_stdout(process)
 
     except Exception as e:
         print(f"[UWB] Error: {e}")
     finally:
         process.terminate()
+        if sock is not None:
+            sock.close()
+            os.unlink(UWB_SOCK_PATH)
         print("[UWB] Subprocess terminated.")
 
+def uwb_from_socket(sock, process):
+    """
+    Receives fixed-size measurement datagrams from nxp.py until stopped.
+    """
+    buf = bytearray(UWB_MEAS_STRUCT.size)
+    sock.settimeout(0.5)  # Wake up periodically to check stop_event
+    while not stop_event.is_set():
+        try:
+            n = sock.recv_into(buf)
+        except socket.timeout:
+            if process.poll() is not None:
+                break
+            continue
+        if n != UWB_MEAS_STRUCT.size:
+            continue
+
+        _, _, dist, azimuth, elevation = UWB_MEAS_STRUCT.unpack_from(buf)
+        latest_uwb.append(UwbSample(dist, azimuth, elevation))
+        uwb_fresh.set()
+
+def uwb_from_stdout(process):
+    """
+    Parses the *** lines printed by nxp.py until stopped.
+    """
+    pattern = UWB_LINE_PATTERN
+
+    while not stop_event.is_set():
+        line = process.stdout.readline()
+        if not line:
+            break
+        
+        # Check if this line contains our data
+        match = pattern.match(line)
+        if match:
+            dist = int(match.group(2))
+            azimuth = float(match.group(3))
+            elevation = float(match.group(4))
+            
+            latest_uwb.append(UwbSample(dist, azimuth, elevation))
+            uwb_fresh.set()
+        
+        # Optional: Print raw line for debug
+        # print(f"[UWB RAW] {line.strip()}")
+
 # ==========================================
 # 2. CAMERA WORKER
 # ==========================================
@@ -109,34 +178,48 @@ def camera_worker():
         
         print("[Camera] Pi Camera recording started.")
         
-        # Raw capture is faster than encoding to JPG in memory repeatedly
-        rawCapture = PiRGBArray(camera, size=(640, 480))
+        # JPEG frames come straight from the GPU encoder, so no CPU time is spent encoding
+        stream = io.BytesIO()
         
         frame_idx = 0
+        dropped = 0
         
         # capture_continuous is the most efficient method for video on Pi
-        for frame_obj in camera.capture_continuous(rawCapture, format="bgr", use_video_port=True):
+        for _ in camera.capture_continuous(stream, format="jpeg", use_video_port=True, quality=JPEG_QUALITY):
             if stop_event.is_set():
                 break
             
-            # Grab the NumPy array representing the image
-            image = frame_obj.array
+            # Nobody will log this frame; discard it without touching the disk
+            if not capture_request.is_set():
+                stream.seek(0)
+                stream.truncate()
+                continue
+            capture_request.clear()
             
             # Generate filename
-            ts = datetime.now().strftime("%H%M%S_%f")
-            filename = f"{IMAGE_FOLDER}/img_{ts}.jpg"
+            sec, ns = divmod(time.time_ns(), 1_000_000_000)
+            filename = f"{IMAGE_FOLDER}/img_{time.strftime('%H%M%S', time.localtime(sec))}_{ns // 1000:06d}.jpg"
             
-            # Save to disk
-            cv2.imwrite(filename, image)
+            # Hand the encoded frame to the writer thread; drop it rather than stall capture
+            try:
+                image_queue.put_nowait((filename, stream.getvalue()))
+            except queue.Full:
+                dropped += 1
+                filename = None
             
             # Update the global data variable for the CSV logger
-            with data_lock:
-                latest_data["image_filename"] = filename
+            if filename is not None:
+                latest_img.append(filename)
+                frame_ready.set()
             
             # Clear the stream in preparation for the next frame
-            rawCapture.truncate(0)
+            stream.seek(0)
+            stream.truncate()
             
             frame_idx += 1
+        
+        if dropped:
+            print(f"[Camera] Dropped {dropped} of {frame_idx} frames (disk writer too slow).")
             
     except Exception as e:
         print(f"[Camera] Error: {e}")
@@ -147,6 +230,21 @@ def camera_worker():
             pass
         print("[Camera] Released.")
 
+def image_writer():
+    """
+    Writes encoded frames from image_queue to disk until None arrives.
+    """
+    while True:
+        item = image_queue.get()
+        if item is None:
+            break
+        filename, data = item
+        try:
+            with open(filename, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            print(f"[Camera] Could not write {filename}: {e}")
+
 # ==========================================
 # 3. IMU WORKER (Placeholder)
 # ==========================================
@@ -165,10 +263,7 @@ def imu_worker():
         acc_z = 9.8 + random.uniform(-0.1, 0.1)
         # ----------------------------------------------
 
-        with data_lock:
-            latest_data["imu_acc_x"] = acc_x
-            latest_data["imu_acc_y"] = acc_y
-            latest_data["imu_acc_z"] = acc_z
+        latest_imu.append(ImuSample(acc_x, acc_y, acc_z))
         
         # IMUs are fast, usually 100Hz+
         time.sleep(0.01)
@@ -176,12 +271,26 @@ def imu_worker():
 # ==========================================
 # MAIN LOOP (The CSV Writer)
 # ==========================================
+def format_iso_ns(ns):
+    """Format epoch nanoseconds as local ISO 8601 with microseconds."""
+    sec, ns = divmod(ns, 1_000_000_000)
+    return f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(sec))}.{ns // 1000:06d}"
+
+def write_rows(writer, rows):
+    """
+    Writes buffered rows, formatting their ns timestamps only now.
+    The rows themselves are left unchanged (timestamps stay ns).
+    """
+    writer.writerows({**row, 'timestamp': format_iso_ns(row['timestamp'])} for row in rows)
+
 def main():
     # Start sensor threads
     t_uwb = threading.Thread(target=uwb_worker)
     t_cam = threading.Thread(target=camera_worker)
     t_imu = threading.Thread(target=imu_worker)
+    t_img = threading.Thread(target=image_writer)
 
+    t_img.start()
     t_uwb.start()
     t_cam.start()
     t_imu.start()
@@ -198,36 +307,62 @@ def main():
         ]
         writer = csv.DictWriter(file, fieldnames=fieldnames)
         writer.writeheader()
+        rows = []  # buffered rows, written in batches of CSV_FLUSH_ROWS
 
         try:
             while True:
-                # Synchronization Rate: e.g., 10Hz (0.1s) or 30Hz (0.033s)
-                # We sample the "Current State" of all sensors at this rate.
-                time.sleep(0.1) 
-
-                current_row = {}
-                with data_lock:
-                    current_row['timestamp'] = datetime.now().isoformat()
-                    current_row['uwb_dist_cm'] = latest_data["uwb_dist"]
-                    current_row['uwb_azimuth_deg'] = latest_data["uwb_azimuth"]
-                    current_row['uwb_elevation_deg'] = latest_data["uwb_elevation"]
-                    current_row['imu_acc_x'] = latest_data["imu_acc_x"]
-                    current_row['imu_acc_y'] = latest_data["imu_acc_y"]
-                    current_row['imu_acc_z'] = latest_data["imu_acc_z"]
-                    current_row['image_file'] = latest_data["image_filename"]
+                # Wake on each new UWB measurement (the slowest sensor), or after
+                # LOG_MAX_INTERVAL so IMU and camera are still logged if UWB goes quiet.
+                # An Event (not a bare Condition.notify) keeps a sample that arrives
+                # while this loop is busy writing.
+                uwb_fresh.wait(LOG_MAX_INTERVAL)
+                uwb_fresh.clear()
+
+                # Ask the camera for a frame for this row and wait for it, so the
+                # row names the image taken for it (None if it was dropped/late)
+                frame_ready.clear()
+                capture_request.set()
+                img = None
+                if t_cam.is_alive() and frame_ready.wait(FRAME_WAIT_SEC):
+                    img = latest_img[-1]
+
+                # Lock-free snapshot of each sensor (empty deque = no data yet)
+                uwb = latest_uwb[-1] if latest_uwb else NO_UWB
+                imu = latest_imu[-1] if latest_imu else NO_IMU
+
+                current_row = {
+                    'timestamp': time.time_ns(),  # formatted in write_rows
+                    'uwb_dist_cm': uwb.dist,
+                    'uwb_azimuth_deg': uwb.azimuth,
+                    'uwb_elevation_deg': uwb.elevation,
+                    'imu_acc_x': imu.acc_x,
+                    'imu_acc_y': imu.acc_y,
+                    'imu_acc_z': imu.acc_z,
+                    'image_file': img,
+                }
                 
-                # Only write if we have at least getting SOME data (optional check)
-                writer.writerow(current_row)
-                file.flush() # Ensure data is written immediately
+                rows.append(current_row)
+                if len(rows) >= CSV_FLUSH_ROWS:
+                    # Hand the batch over before writing, so an interrupt mid-write
+                    # can't make the finally block write these rows again
+                    batch, rows = rows, []
+                    write_rows(writer, batch)
 
         except KeyboardInterrupt:
             print("\nStopping logging...")
             stop_event.set()
+        finally:
+            # Write the last partial batch and make sure it reaches the disk
+            write_rows(writer, rows)
+            file.flush()
+            os.fsync(file.fileno())
 
     # Wait for threads to finish
     t_uwb.join()
     t_cam.join()
     t_imu.join()
+    image_queue.put(None)  # Camera has stopped; let the writer drain and exit
+    t_img.join()
     print("Done.")
 
 if __name__ == "__main__":
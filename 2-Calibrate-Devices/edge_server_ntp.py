@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
 
 import argparse
-import base64
+import itertools
 import json
+import os
 import socket
 import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from math import cos, sin, radians, sqrt
 
 import numpy as np
@@ -12,16 +16,33 @@ import cv2
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D  # noqa: F401
 
+try:
+    from pybase64 import b64decode  # SIMD decoder, much faster on large frames
+except ImportError:
+    from base64 import b64decode
+
 
 # Shared state
 data_lock = threading.Lock()
 latest = {}       # node_id -> {"timestamp", "frame_rgb", "uwb", "imu"}
 node_order = []   # order nodes appear (for reference node)
 
-# Trajectory history: node_id -> {"x": [], "y": [], "z": []}
+# Trajectory history: node_id -> {"x": deque, "y": deque, "z": deque}
+# (deque(maxlen=MAX_HISTORY) drops the oldest point in O(1) on append)
 positions_hist = {}
 MAX_HISTORY = 500  # max points to keep per node
 
+# JPEG decoding runs on a worker pool so handle_client keeps reading messages
+DECODE_WORKERS = os.cpu_count() or 2
+DECODE_FLAGS = cv2.IMREAD_REDUCED_COLOR_2  # half-size decode, plenty for the image panels
+decoder = ThreadPoolExecutor(max_workers=DECODE_WORKERS)
+decode_slots = threading.BoundedSemaphore(2 * DECODE_WORKERS)  # frames queued or decoding
+frame_seq = itertools.count()  # arrival order, so a late decode never replaces a newer frame
+latest_seq = {}   # node_id -> frame_seq of the frame in latest
+
+ACCEPT_THREADS = min(4, os.cpu_count() or 1)  # SO_REUSEPORT listeners on the server port
+RECV_BUF_SIZE = 1 << 20  # initial per-connection receive buffer (grows for bigger messages)
+
 NODE_COLORS = [
     "tab:blue",
     "tab:orange",
@@ -32,11 +53,87 @@ NODE_COLORS = [
 ]
 
 
+def decode_frame(img_b64):
+    """Decode a base64 JPEG into an RGB frame rotated 180° (None if undecodable)."""
+    img_bytes = b64decode(img_b64)
+    np_arr = np.frombuffer(img_bytes, np.uint8)
+    frame = cv2.imdecode(np_arr, DECODE_FLAGS)
+    if frame is None:
+        return None
+    # Reversed rows + cols = 180° rotation, reversed channels = BGR->RGB;
+    # a strided view (no copy), which imshow/set_data accept as-is
+    return frame[::-1, ::-1, ::-1]
+
+
+def store_frame(node_id, seq, ts, uwb, imu, future):
+    """Decoder callback: publish a decoded frame with its telemetry."""
+    decode_slots.release()
+    try:
+        frame_rgb = future.result()
+    except Exception as e:
+        print("[IMG] decode error:", e)
+        return
+    if frame_rgb is None:
+        return
+
+    with data_lock:
+        if seq < latest_seq.get(node_id, -1):
+            return
+        latest_seq[node_id] = seq
+        if node_id not in node_order:
+            node_order.append(node_id)
+            print(f"[INFO] New node: {node_id} (index {len(node_order)-1})")
+        latest[node_id] = {
+            "timestamp": ts,
+            "frame_rgb": frame_rgb,
+            "uwb": uwb,
+            "imu": imu,
+            "imu_angles": imu_angles(imu),  # parsed once here, not every viewer frame
+        }
+
+
+def iter_lines(conn):
+    """
+    Yield newline-terminated messages from conn as bytes (without the newline).
+    Reads with recv_into into one reusable buffer instead of a file object.
+    """
+    buf = bytearray(RECV_BUF_SIZE)
+    view = memoryview(buf)
+    start = end = scan = 0  # buf[start:end] is unconsumed, buf[start:scan] has no newline
+    while True:
+        nl = buf.find(b"\n", scan, end)
+        if nl >= 0:
+            yield bytes(view[start:nl])
+            start = scan = nl + 1
+            continue
+
+        if start == end:
+            start = end = scan = 0
+        elif end == len(buf):
+            if start:
+                # Move the partial message to the front of the buffer
+                buf[:end - start] = bytes(view[start:end])
+                end -= start
+                start = 0
+            else:
+                # One message is larger than the buffer: double it
+                view.release()
+                buf.extend(bytes(len(buf)))
+                view = memoryview(buf)
+            scan = end
+        else:
+            scan = end
+
+        n = conn.recv_into(view[end:])
+        if n == 0:
+            return
+        end += n
+
+
 def handle_client(conn, addr):
     print(f"[NET] Connection from {addr}")
-    f = conn.makefile("r")
     try:
-        for line in f:
+        for line in iter_lines(conn):
             line = line.strip()
             if not line:
                 continue
@@ -55,29 +152,13 @@ def handle_client(conn, addr):
             if not img_b64:
                 continue
 
-            # Decode + rotate 180°
-            try:
-                img_bytes = base64.b64decode(img_b64)
-                np_arr = np.frombuffer(img_bytes, np.uint8)
-                frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-                if frame is None:
-                    continue
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                frame_rgb = np.rot90(frame_rgb, 2)
-            except Exception as e:
-                print("[IMG] decode error:", e)
+            # Decode + rotate 180° on the pool; if every decoder is busy drop
+            # this frame, the viewer only ever shows the newest one anyway
+            if not decode_slots.acquire(blocking=False):
                 continue
-
-            with data_lock:
-                if node_id not in node_order:
-                    node_order.append(node_id)
-                    print(f"[INFO] New node: {node_id} (index {len(node_order)-1})")
-                latest[node_id] = {
-                    "timestamp": ts,
-                    "frame_rgb": frame_rgb,
-                    "uwb": uwb,
-                    "imu": imu,
-                }
+            seq = next(frame_seq)
+            future = decoder.submit(decode_frame, img_b64)
+            future.add_done_callback(partial(store_frame, node_id, seq, ts, uwb, imu))
 
     except Exception as e:
         print("[NET] client error:", e)
@@ -86,18 +167,34 @@ def handle_client(conn, addr):
         print(f"[NET] connection closed {addr}")
 
 
-def server_thread(port):
+def open_listener(port, reuse_port):
     srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     srv.bind(("0.0.0.0", port))
     srv.listen(5)
-    print(f"[NET] Listening on 0.0.0.0:{port}")
+    return srv
+
+
+def accept_loop(srv):
     while True:
         conn, addr = srv.accept()
         t = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
         t.start()
 
 
+def server_thread(port):
+    # With SO_REUSEPORT each listener has its own accept queue and the kernel
+    # spreads new connections across them; without it use a single listener
+    n = ACCEPT_THREADS if hasattr(socket, "SO_REUSEPORT") else 1
+    listeners = [open_listener(port, n > 1) for _ in range(n)]
+    print(f"[NET] Listening on 0.0.0.0:{port} ({n} accept thread(s))")
+    for srv in listeners[1:]:
+        threading.Thread(target=accept_loop, args=(srv,), daemon=True).start()
+    accept_loop(listeners[0])
+
+
 def spherical_to_cartesian(dist_cm, az_deg, el_deg):
     r = float(dist_cm)
     az = radians(float(az_deg))
@@ -108,20 +205,26 @@ def spherical_to_cartesian(dist_cm, az_deg, el_deg):
     return x, y, z
 
 
-def orientation_vector_from_imu(imu):
-    heading = imu.get("heading")
-    pitch = imu.get("pitch")
-    if heading is None or pitch is None:
-        return None
-    try:
-        yaw_rad = radians(float(heading))
-        pitch_rad = radians(float(pitch))
-    except (TypeError, ValueError):
-        return None
-    vx = cos(pitch_rad) * cos(yaw_rad)
-    vy = cos(pitch_rad) * sin(yaw_rad)
-    vz = sin(pitch_rad)
-    return vx, vy, vz
+def imu_angles(imu):
+    """Heading and pitch (deg) from an IMU message as floats, NaN when missing or bad."""
+    angles = []
+    for key in ("heading", "pitch"):
+        try:
+            angles.append(float(imu.get(key)))
+        except (TypeError, ValueError):
+            angles.append(float("nan"))
+    return tuple(angles)
+
+
+def orientation_vector_from_imu(heading_deg, pitch_deg):
+    """
+    Orientation vectors for arrays of heading (yaw) and pitch in degrees.
+    Returns an (n, 3) array; rows with a NaN angle come out as NaN.
+    """
+    yaw = np.radians(heading_deg)
+    pitch = np.radians(pitch_deg)
+    cos_pitch = np.cos(pitch)
+    return np.column_stack((cos_pitch * np.cos(yaw), cos_pitch * np.sin(yaw), np.sin(pitch)))
 
 
 def main():
@@ -150,6 +253,23 @@ def main():
     im1 = None
     im2 = None
 
+    # 3D artists are created once and updated in place each frame
+    ax3.set_title("Relative positions & orientation (UWB + IMU)")
+    ax3.set_xlabel("X (cm)")
+    ax3.set_ylabel("Y (cm)")
+    ax3.set_zlabel("Z (cm)")
+    axis_range = 10.0  # current symmetric axis limit (cm)
+    ax3.set_xlim(-axis_range, axis_range)
+    ax3.set_ylim(-axis_range, axis_range)
+    ax3.set_zlim(-axis_range, axis_range)
+
+    node_artists = {}  # node_id -> {"line", "scat", "text"}
+    (link_line,) = ax3.plot([], [], [], color="k", linestyle="--", linewidth=1.5)
+    distance_label = ax3.text2D(0.02, 0.95, "", transform=ax3.transAxes)
+    arrow_artist = None  # one quiver for all arrows; no 3D setter, so replaced each frame
+
+    plt.tight_layout()
+
     try:
         while True:
             with data_lock:
@@ -191,23 +311,13 @@ def main():
             # -----------------------------------------
 
             # ---------- 3D plot ----------
-            ax3.cla()
-            ax3.set_title("Relative positions & orientation (UWB + IMU)")
-            ax3.set_xlabel("X (cm)")
-            ax3.set_ylabel("Y (cm)")
-            ax3.set_zlabel("Z (cm)")
-
             positions = {}   # node_id -> (x,y,z)
-            arrows = []
+            arrow_nodes = []  # (node_id, color) of nodes that get an orientation arrow
 
             # reference at origin
             positions[ref_id] = (0.0, 0.0, 0.0)
-            d_ref = data_snap.get(ref_id)
-            if d_ref:
-                v_ref = orientation_vector_from_imu(d_ref.get("imu", {}))
-                color_ref = NODE_COLORS[0 % len(NODE_COLORS)]
-                if v_ref is not None:
-                    arrows.append((*positions[ref_id], *v_ref, color_ref))
+            if data_snap.get(ref_id):
+                arrow_nodes.append((ref_id, NODE_COLORS[0 % len(NODE_COLORS)]))
 
             # other nodes from their UWB relative to ref
             for i, nid in enumerate(node_ids):
@@ -227,71 +337,59 @@ def main():
                 except Exception:
                     continue
                 positions[nid] = (x, y, z)
-                v = orientation_vector_from_imu(d.get("imu", {}))
-                color = NODE_COLORS[i % len(NODE_COLORS)]
-                if v is not None:
-                    arrows.append((x, y, z, *v, color))
+                arrow_nodes.append((nid, NODE_COLORS[i % len(NODE_COLORS)]))
 
             # update trajectory history
             for i, nid in enumerate(node_ids):
                 if nid not in positions:
                     continue
                 x, y, z = positions[nid]
-                hist = positions_hist.setdefault(
-                    nid, {"x": [], "y": [], "z": []}
-                )
+                hist = positions_hist.get(nid)
+                if hist is None:
+                    hist = positions_hist[nid] = {
+                        axis: deque(maxlen=MAX_HISTORY) for axis in ("x", "y", "z")
+                    }
                 hist["x"].append(x)
                 hist["y"].append(y)
                 hist["z"].append(z)
-                # keep history short
-                if len(hist["x"]) > MAX_HISTORY:
-                    hist["x"].pop(0)
-                    hist["y"].pop(0)
-                    hist["z"].pop(0)
 
-            # draw trajectories + current points
+            # update trajectories + current points
             all_coords = []
             for i, nid in enumerate(node_ids):
                 if nid not in positions_hist:
                     continue
                 hist = positions_hist[nid]
-                color = NODE_COLORS[i % len(NODE_COLORS)]
-                if len(hist["x"]) > 1:
-                    ax3.plot(
-                        hist["x"],
-                        hist["y"],
-                        hist["z"],
-                        color=color,
-                        alpha=0.8,
-                        linewidth=2,
-                    )
-                if nid in positions:
+                artists = node_artists.get(nid)
+                if artists is None:
+                    color = NODE_COLORS[i % len(NODE_COLORS)]
+                    (line,) = ax3.plot([], [], [], color=color, alpha=0.8, linewidth=2)
+                    artists = node_artists[nid] = {
+                        "line": line,
+                        "scat": ax3.scatter([], [], [], s=60, color=color),
+                        "text": ax3.text(0.0, 0.0, 0.0, ""),
+                    }
+                artists["line"].set_data_3d(hist["x"], hist["y"], hist["z"])
+                visible = nid in positions
+                artists["scat"].set_visible(visible)
+                artists["text"].set_visible(visible)
+                if visible:
                     x, y, z = positions[nid]
-                    ax3.scatter([x], [y], [z], s=60, color=color)
-                    ax3.text(
-                        x,
-                        y,
-                        z,
-                        id_to_label.get(nid, nid),
-                    )
+                    artists["scat"]._offsets3d = ([x], [y], [z])
+                    artists["text"].set_position_3d((x, y, z))
+                    artists["text"].set_text(id_to_label.get(nid, nid))
                     all_coords.extend([x, y, z])
 
             # line and distance between ref and first other node (if exists)
             distance_text = "N/A"
+            link_line.set_visible(False)
             if len(node_ids) > 1 and ref_id in positions:
                 ref_pos = positions[ref_id]
                 other_id = node_ids[1]  # second node in session
                 if other_id in positions:
                     x0, y0, z0 = ref_pos
                     x1, y1, z1 = positions[other_id]
-                    ax3.plot(
-                        [x0, x1],
-                        [y0, y1],
-                        [z0, z1],
-                        color="k",
-                        linestyle="--",
-                        linewidth=1.5,
-                    )
+                    link_line.set_data_3d([x0, x1], [y0, y1], [z0, z1])
+                    link_line.set_visible(True)
                     dx = x1 - x0
                     dy = y1 - y0
                     dz = z1 - z0
@@ -299,39 +397,48 @@ def main():
                     distance_text = f"{dist_cm:.1f} cm"
                     all_coords.extend([x0, y0, z0, x1, y1, z1])
 
-            # axis limits
+            # axis limits, only touched when the range actually changes
             if all_coords:
                 max_range = max(max(abs(c) for c in all_coords), 10.0)
-                ax3.set_xlim(-max_range, max_range)
-                ax3.set_ylim(-max_range, max_range)
-                ax3.set_zlim(-max_range, max_range)
-
-            # draw orientation arrows
-            for (x, y, z, vx, vy, vz, color) in arrows:
-                if not all(np.isfinite([x, y, z, vx, vy, vz])):
-                    continue
-                length = 0.25 * (ax3.get_xlim()[1] - ax3.get_xlim()[0])
-                ax3.quiver(
-                    x,
-                    y,
-                    z,
-                    vx,
-                    vy,
-                    vz,
-                    length=length,
-                    normalize=True,
-                    color=color,
-                )
+                if max_range != axis_range:
+                    axis_range = max_range
+                    ax3.set_xlim(-axis_range, axis_range)
+                    ax3.set_ylim(-axis_range, axis_range)
+                    ax3.set_zlim(-axis_range, axis_range)
+
+            # draw orientation arrows, all in a single quiver
+            if arrow_artist is not None:
+                arrow_artist.remove()
+                arrow_artist = None
+            if arrow_nodes:
+                # Orientation of every node in one vectorised call; NaN rows
+                # (no heading/pitch) are masked out with any bad positions
+                angles = np.array([data_snap[nid]["imu_angles"] for nid, _ in arrow_nodes])
+                vecs = np.hstack((
+                    np.array([positions[nid] for nid, _ in arrow_nodes], dtype=float),
+                    orientation_vector_from_imu(angles[:, 0], angles[:, 1]),
+                ))
+                keep = np.isfinite(vecs).all(axis=1)
+                if keep.any():
+                    vecs = vecs[keep]
+                    colors = [c for (_, c), k in zip(arrow_nodes, keep) if k]
+                    # mplot3d emits every shaft, then side 0 of every head, then side 1
+                    seg_colors = np.concatenate([colors, colors, colors])
+                    arrow_artist = ax3.quiver(
+                        vecs[:, 0],
+                        vecs[:, 1],
+                        vecs[:, 2],
+                        vecs[:, 3],
+                        vecs[:, 4],
+                        vecs[:, 5],
+                        length=0.5 * axis_range,
+                        normalize=True,
+                        colors=seg_colors,
+                    )
 
             # show distance in text
-            ax3.text2D(
-                0.02,
-                0.95,
-                f"Distance pinode0 ↔ pinode1: {distance_text}",
-                transform=ax3.transAxes,
-            )
-
-            plt.tight_layout()
+            distance_label.set_text(f"Distance pinode0 ↔ pinode1: {distance_text}")
+
             plt.pause(0.05)
 
     except KeyboardInterrupt:
@@ -24,41 +24,70 @@ import math
 import numpy as np
 import pandas as pd
 
+from uwb_geometry import HAS_NUMBA, njit, prange, spherical_to_cartesian_np
 
-def spherical_to_cartesian(dist_cm, az_deg, el_deg):
-    """
-    Convert spherical (distance, azimuth, elevation) to Cartesian (x, y, z).
-
-    dist_cm : radius in cm
-    az_deg  : azimuth in degrees (0 = +X axis, CCW towards +Y)
-    el_deg  : elevation in degrees (0 = XY plane, +Z up)
-    """
-    if pd.isna(dist_cm) or pd.isna(az_deg) or pd.isna(el_deg):
-        return (np.nan, np.nan, np.nan)
-
-    r = float(dist_cm)
-    az = math.radians(float(az_deg))
-    el = math.radians(float(el_deg))
+# fastmath without the no-NaN/no-Inf assumptions, so missing samples stay NaN
+KERNEL_FASTMATH = {"nsz", "arcp", "contract", "afn", "reassoc"}
 
-    x = r * math.cos(el) * math.cos(az)
-    y = r * math.cos(el) * math.sin(az)
-    z = r * math.sin(el)
-    return x, y, z
+# Angle columns that get a delta relative to their first valid value, in
+# the order the deltas are computed
+ANGLE_COLS = [
+    "imu_heading_deg_n1", "imu_pitch_deg_n1",
+    "imu_heading_deg_n2", "imu_pitch_deg_n2",
+    "uwb_azimuth_deg_n1", "uwb_elevation_deg_n1",
+    "uwb_azimuth_deg_n2", "uwb_elevation_deg_n2",
+]
 
 
 def angle_diff_deg(a, b):
     """
     Smallest signed difference a-b in degrees in [-180, 180].
+    Element-wise on float32 arrays (b may be a scalar baseline).
     Returns NaN if either is NaN.
     """
-    if pd.isna(a) or pd.isna(b):
-        return np.nan
-    a = float(a)
-    b = float(b)
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
     d = (a - b + 180.0) % 360.0 - 180.0
     return d
 
 
+@njit(parallel=True, cache=True, fastmath=KERNEL_FASTMATH)
+def process_frames(r1, az1, el1, r2, az2, el2, angles, bases, out):
+    """
+    Single fused pass over all frames (numba). Writes into the rows of out:
+    x1, y1, z1, x2, y2, z2, distance, then one delta per row of angles
+    (angles[k] - bases[k], wrapped to [-180, 180]).
+    """
+    for i in prange(r1.size):
+        az = math.radians(az1[i])
+        el = math.radians(el1[i])
+        r_cos_el = r1[i] * math.cos(el)
+        x1 = r_cos_el * math.cos(az)
+        y1 = r_cos_el * math.sin(az)
+        z1 = r1[i] * math.sin(el)
+        if math.isnan(az1[i]):
+            z1 = np.nan  # z has no azimuth term; a partial fix stays all-NaN
+
+        az = math.radians(az2[i])
+        el = math.radians(el2[i])
+        r_cos_el = r2[i] * math.cos(el)
+        x2 = r_cos_el * math.cos(az)
+        y2 = r_cos_el * math.sin(az)
+        z2 = r2[i] * math.sin(el)
+        if math.isnan(az2[i]):
+            z2 = np.nan
+
+        out[0, i] = x1
+        out[1, i] = y1
+        out[2, i] = z1
+        out[3, i] = x2
+        out[4, i] = y2
+        out[5, i] = z2
+        out[6, i] = math.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2)
+        for k in range(bases.size):
+            out[7 + k, i] = (angles[k, i] - bases[k] + 180.0) % 360.0 - 180.0
+
+
 def build_parser():
     p = argparse.ArgumentParser(description="Convert UWB to Cartesian and summarize IMU/UWB changes.")
     p.add_argument("--node1", default="node1_frames.csv",
@@ -80,101 +109,68 @@ def main():
     # Merge by frame_index so we have one row per paired frame
     df = df1.merge(df2, on="frame_index", suffixes=("_n1", "_n2"))
 
+    # float32 halves the memory traffic of the trig/sqrt passes below
+    def col(name):
+        return df[name].to_numpy(dtype=np.float32)
+
     # Baseline IMU + UWB angles (first non-NaN for each node)
-    base_h1 = df["imu_heading_deg_n1"].dropna().iloc[0]
-    base_p1 = df["imu_pitch_deg_n1"].dropna().iloc[0]
-    base_h2 = df["imu_heading_deg_n2"].dropna().iloc[0]
-    base_p2 = df["imu_pitch_deg_n2"].dropna().iloc[0]
-
-    base_az1 = df["uwb_azimuth_deg_n1"].dropna().iloc[0]
-    base_el1 = df["uwb_elevation_deg_n1"].dropna().iloc[0]
-    base_az2 = df["uwb_azimuth_deg_n2"].dropna().iloc[0]
-    base_el2 = df["uwb_elevation_deg_n2"].dropna().iloc[0]
-
-    x1_list, y1_list, z1_list = [], [], []
-    x2_list, y2_list, z2_list = [], [], []
-    dist_list = []
-
-    dhead1_list, dpitch1_list = [], []
-    dhead2_list, dpitch2_list = [], []
-
-    daz1_list, del1_list = [], []
-    daz2_list, del2_list = [], []
-
-    for _, r in df.iterrows():
-        # Cartesian positions from UWB
-        x1, y1, z1 = spherical_to_cartesian(
-            r["uwb_distance_cm_n1"], r["uwb_azimuth_deg_n1"], r["uwb_elevation_deg_n1"]
-        )
-        x2, y2, z2 = spherical_to_cartesian(
-            r["uwb_distance_cm_n2"], r["uwb_azimuth_deg_n2"], r["uwb_elevation_deg_n2"]
-        )
-
-        x1_list.append(x1)
-        y1_list.append(y1)
-        z1_list.append(z1)
-
-        x2_list.append(x2)
-        y2_list.append(y2)
-        z2_list.append(z2)
-
-        if not any(pd.isna(v) for v in (x1, y1, z1, x2, y2, z2)):
-            dx = x1 - x2
-            dy = y1 - y2
-            dz = z1 - z2
-            dist = math.sqrt(dx * dx + dy * dy + dz * dz)
-        else:
-            dist = np.nan
-        dist_list.append(dist)
-
-        # IMU heading/pitch deltas
-        dhead1_list.append(angle_diff_deg(r["imu_heading_deg_n1"], base_h1))
-        dpitch1_list.append(angle_diff_deg(r["imu_pitch_deg_n1"], base_p1))
-        dhead2_list.append(angle_diff_deg(r["imu_heading_deg_n2"], base_h2))
-        dpitch2_list.append(angle_diff_deg(r["imu_pitch_deg_n2"], base_p2))
-
-        # UWB azimuth/elevation deltas
-        daz1_list.append(angle_diff_deg(r["uwb_azimuth_deg_n1"], base_az1))
-        del1_list.append(angle_diff_deg(r["uwb_elevation_deg_n1"], base_el1))
-        daz2_list.append(angle_diff_deg(r["uwb_azimuth_deg_n2"], base_az2))
-        del2_list.append(angle_diff_deg(r["uwb_elevation_deg_n2"], base_el2))
+    bases = np.array([df[c].dropna().iloc[0] for c in ANGLE_COLS], dtype=np.float32)
+    angles = np.stack([col(c) for c in ANGLE_COLS])
+
+    uwb1 = (col("uwb_distance_cm_n1"), col("uwb_azimuth_deg_n1"), col("uwb_elevation_deg_n1"))
+    uwb2 = (col("uwb_distance_cm_n2"), col("uwb_azimuth_deg_n2"), col("uwb_elevation_deg_n2"))
+
+    if HAS_NUMBA:
+        res = np.empty((7 + len(ANGLE_COLS), len(df)), dtype=np.float32)
+        process_frames(*uwb1, *uwb2, angles, bases, res)
+        x1, y1, z1, x2, y2, z2, dist = res[:7]
+        deltas = res[7:]
+    else:
+        # Cartesian positions from UWB, whole columns at once
+        x1, y1, z1 = spherical_to_cartesian_np(*uwb1, dtype=np.float32)
+        x2, y2, z2 = spherical_to_cartesian_np(*uwb2, dtype=np.float32)
+
+        # NaN wherever either node has no UWB fix
+        dist = np.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2 + (z1 - z2) ** 2)
+        deltas = angle_diff_deg(angles, bases[:, None])
+    dhead1, dpitch1, dhead2, dpitch2, daz1, del1, daz2, del2 = deltas
 
     # Build output dataframe
     out = pd.DataFrame({
         "frame_index": df["frame_index"],
 
         # Cartesian coords (cm)
-        "node1_x_cm": x1_list,
-        "node1_y_cm": y1_list,
-        "node1_z_cm": z1_list,
-        "node2_x_cm": x2_list,
-        "node2_y_cm": y2_list,
-        "node2_z_cm": z2_list,
+        "node1_x_cm": x1,
+        "node1_y_cm": y1,
+        "node1_z_cm": z1,
+        "node2_x_cm": x2,
+        "node2_y_cm": y2,
+        "node2_z_cm": z2,
 
         # Approx distance between nodes (cm)
-        "distance_between_cm": dist_list,
+        "distance_between_cm": dist,
 
         # IMU heading/pitch + deltas
         "node1_heading_deg": df["imu_heading_deg_n1"],
-        "node1_dheading_deg": dhead1_list,
+        "node1_dheading_deg": dhead1,
         "node1_pitch_deg": df["imu_pitch_deg_n1"],
-        "node1_dpitch_deg": dpitch1_list,
+        "node1_dpitch_deg": dpitch1,
 
         "node2_heading_deg": df["imu_heading_deg_n2"],
-        "node2_dheading_deg": dhead2_list,
+        "node2_dheading_deg": dhead2,
         "node2_pitch_deg": df["imu_pitch_deg_n2"],
-        "node2_dpitch_deg": dpitch2_list,
+        "node2_dpitch_deg": dpitch2,
 
         # UWB angles + deltas
         "node1_azimuth_deg": df["uwb_azimuth_deg_n1"],
-        "node1_dazimuth_deg": daz1_list,
+        "node1_dazimuth_deg": daz1,
         "node1_elevation_deg": df["uwb_elevation_deg_n1"],
-        "node1_delevation_deg": del1_list,
+        "node1_delevation_deg": del1,
 
         "node2_azimuth_deg": df["uwb_azimuth_deg_n2"],
-        "node2_dazimuth_deg": daz2_list,
+        "node2_dazimuth_deg": daz2,
         "node2_elevation_deg": df["uwb_elevation_deg_n2"],
-        "node2_delevation_deg": del2_list,
+        "node2_delevation_deg": del2,
     })
 
     # Save full table to CSV for deeper inspection
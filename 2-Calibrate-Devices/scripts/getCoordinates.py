@@ -2,10 +2,10 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D  # noqa: F401
-from math import radians, cos, sin, sqrt
-from datetime import datetime
 import time
 
+from uwb_geometry import spherical_to_cartesian_np
+
 # ========= USER CONFIG =========
 NODE1_CSV = "2-Calibrate-Devices/output/session_node1/node1_frames.csv"
 NODE2_CSV = "2-Calibrate-Devices/output/session_node2/node2_frames.csv"
@@ -15,50 +15,27 @@ PLAYBACK_SPEED = 1.0
 # ===============================
 
 
-def parse_time(ts):
-    if pd.isna(ts):
-        return None
-    try:
-        return datetime.fromisoformat(str(ts))
-    except Exception:
-        return None
-
-
-def spherical_to_cartesian(dist_cm, az_deg, el_deg):
+def parse_times(col):
     """
-    Convert spherical (distance, azimuth, elevation) to Cartesian (x, y, z).
-
-    dist_cm : radius in cm
-    az_deg  : azimuth in degrees (0 = +X, CCW towards +Y)
-    el_deg  : elevation in degrees (0 = XY plane, +Z up)
+    Parse a column of ISO timestamps in one vectorised pass (cache=True reuses
+    the result for repeated strings). Missing or malformed stamps become NaT.
+    The format is inferred: format="ISO8601" needs pandas 2, and on 1.x it
+    would turn every stamp into NaT under errors="coerce".
     """
-    r = float(dist_cm)
-    az = radians(float(az_deg))
-    el = radians(float(el_deg))
-
-    x = r * cos(el) * cos(az)
-    y = r * cos(el) * sin(az)
-    z = r * sin(el)
-    return x, y, z
+    return pd.to_datetime(col, errors="coerce", cache=True)
 
 
-def orientation_vector_from_imu(heading_deg, pitch_deg):
+def orientation_vector_from_imu_np(heading_deg, pitch_deg):
     """
-    Compute a simple 3D orientation vector from IMU heading (yaw) and pitch.
-    Roll is ignored here.
+    Compute simple 3D orientation vectors from IMU heading (yaw) and pitch
+    columns. Roll is ignored here. Returns an (n, 3) array; rows with a
+    missing angle come out as NaN.
     """
-    if heading_deg is None or pitch_deg is None:
-        return None
-    try:
-        yaw = radians(float(heading_deg))
-        pitch = radians(float(pitch_deg))
-    except Exception:
-        return None
+    yaw = np.deg2rad(np.asarray(heading_deg, dtype=np.float32))
+    pitch = np.deg2rad(np.asarray(pitch_deg, dtype=np.float32))
 
-    vx = cos(pitch) * cos(yaw)
-    vy = cos(pitch) * sin(yaw)
-    vz = sin(pitch)
-    return vx, vy, vz
+    cos_pitch = np.cos(pitch)
+    return np.column_stack((cos_pitch * np.cos(yaw), cos_pitch * np.sin(yaw), np.sin(pitch)))
 
 
 def safe_val(val):
@@ -82,23 +59,20 @@ def main():
     df2 = df2.iloc[:n].reset_index(drop=True)
 
     # ---- Build a time axis from timestamps ----
-    t1 = df1["img_timestamp_iso"].apply(parse_time)
-    t2 = df2["img_timestamp_iso"].apply(parse_time)
-
-    times = []
-    for a, b in zip(t1, t2):
-        if a and b:
-            times.append(min(a, b))
-        elif a:
-            times.append(a)
-        else:
-            times.append(b)
+    t1 = parse_times(df1["img_timestamp_iso"])
+    t2 = parse_times(df2["img_timestamp_iso"])
+
+    # Pair the two nodes' stamps as int64 nanoseconds: the earlier of the two,
+    # or whichever exists when one is missing (NaT)
+    nat = np.iinfo(np.int64).min
+    ns1 = pd.DatetimeIndex(t1).asi8
+    ns2 = pd.DatetimeIndex(t2).asi8
+    times_ns = np.where(ns1 == nat, ns2, np.where(ns2 == nat, ns1, np.minimum(ns1, ns2)))
+    times_ns = times_ns[times_ns != nat]
 
     # Estimate frame interval from timestamps
-    if len(times) > 1:
-        deltas = [(times[i + 1] - times[i]).total_seconds()
-                  for i in range(len(times) - 1)]
-        median_dt = float(np.median(deltas))
+    if len(times_ns) > 1:
+        median_dt = float(np.median(np.diff(times_ns))) / 1e9
         base_interval = max(0.05, median_dt)  # seconds
     else:
         base_interval = 1.0
@@ -108,68 +82,45 @@ def main():
     print(f"Estimated frame interval: {base_interval:.3f} s, "
           f"playback interval: {step_interval:.3f} s")
 
-    # ---- Precompute positions and distances ----
-    positions1 = []
-    positions2 = []
-    node_distance = []
-
-    # For export
-    export_rows = []
-
-    for i in range(n):
-        row1 = df1.iloc[i]
-        row2 = df2.iloc[i]
-
-        # Node 1 position
-        p1 = None
-        if (not np.isnan(row1["uwb_distance_cm"])
-                and not np.isnan(row1["uwb_azimuth_deg"])
-                and not np.isnan(row1["uwb_elevation_deg"])):
-            p1 = spherical_to_cartesian(
-                row1["uwb_distance_cm"],
-                row1["uwb_azimuth_deg"],
-                row1["uwb_elevation_deg"],
-            )
-
-        # Node 2 position
-        p2 = None
-        if (not np.isnan(row2["uwb_distance_cm"])
-                and not np.isnan(row2["uwb_azimuth_deg"])
-                and not np.isnan(row2["uwb_elevation_deg"])):
-            p2 = spherical_to_cartesian(
-                row2["uwb_distance_cm"],
-                row2["uwb_azimuth_deg"],
-                row2["uwb_elevation_deg"],
-            )
-
-        positions1.append(p1)
-        positions2.append(p2)
-
-        if p1 is not None and p2 is not None:
-            dx = p1[0] - p2[0]
-            dy = p1[1] - p2[1]
-            dz = p1[2] - p2[2]
-            d = sqrt(dx * dx + dy * dy + dz * dz)
-        else:
-            d = float("nan")
-        node_distance.append(d)
-
-        # For CSV export: collect coordinates + distance
-        export_rows.append({
-            "frame_index": i + 1,
-            "time_node1": df1.loc[i, "img_timestamp_iso"],
-            "time_node2": df2.loc[i, "img_timestamp_iso"],
-            "node1_x_cm": p1[0] if p1 is not None else np.nan,
-            "node1_y_cm": p1[1] if p1 is not None else np.nan,
-            "node1_z_cm": p1[2] if p1 is not None else np.nan,
-            "node2_x_cm": p2[0] if p2 is not None else np.nan,
-            "node2_y_cm": p2[1] if p2 is not None else np.nan,
-            "node2_z_cm": p2[2] if p2 is not None else np.nan,
-            "distance_cm": d,
-        })
+    # ---- Precompute positions and distances (whole columns at once) ----
+    # float32 is ample for cm-level UWB data; rows with any NaN input are NaN
+    xyz1 = np.column_stack(spherical_to_cartesian_np(
+        df1["uwb_distance_cm"], df1["uwb_azimuth_deg"], df1["uwb_elevation_deg"],
+        dtype=np.float32))
+    xyz2 = np.column_stack(spherical_to_cartesian_np(
+        df2["uwb_distance_cm"], df2["uwb_azimuth_deg"], df2["uwb_elevation_deg"],
+        dtype=np.float32))
+
+    # IMU orientation arrows for every frame
+    orient1 = orientation_vector_from_imu_np(df1["imu_heading_deg"], df1["imu_pitch_deg"])
+    orient2 = orientation_vector_from_imu_np(df2["imu_heading_deg"], df2["imu_pitch_deg"])
+    orient1_ok = np.isfinite(orient1).all(axis=1)
+    orient2_ok = np.isfinite(orient2).all(axis=1)
+
+    # Inter-node distance; NaN propagates when either node has no fix
+    node_distance = np.sqrt(((xyz1 - xyz2) ** 2).sum(axis=1))
+
+    # Per-frame tuples for the playback loop; None when the node has no UWB fix
+    valid1 = ~np.isnan(xyz1).any(axis=1)
+    valid2 = ~np.isnan(xyz2).any(axis=1)
+    positions1 = [tuple(p) if ok else None for p, ok in zip(xyz1.tolist(), valid1)]
+    positions2 = [tuple(p) if ok else None for p, ok in zip(xyz2.tolist(), valid2)]
+
+    # For export: coordinates + distance
+    export_df = pd.DataFrame({
+        "frame_index": np.arange(1, n + 1),
+        "time_node1": df1["img_timestamp_iso"],
+        "time_node2": df2["img_timestamp_iso"],
+        "node1_x_cm": xyz1[:, 0],
+        "node1_y_cm": xyz1[:, 1],
+        "node1_z_cm": xyz1[:, 2],
+        "node2_x_cm": xyz2[:, 0],
+        "node2_y_cm": xyz2[:, 1],
+        "node2_z_cm": xyz2[:, 2],
+        "distance_cm": node_distance,
+    })
 
     # ---- Save XYZ + distance to a new CSV ----
-    export_df = pd.DataFrame(export_rows)
     export_df.to_csv("paired_coordinates.csv", index=False)
     print("Saved XYZ + distance data to paired_coordinates.csv")
 
@@ -202,17 +153,16 @@ def main():
     )
 
     # Precompute axis limits from all positions
-    all_coords = []
-    for p in positions1 + positions2:
-        if p is not None:
-            all_coords.extend(p)
-
-    if all_coords:
-        max_abs = max(abs(float(c)) for c in all_coords)
-        max_abs = max(max_abs, 10.0)
+    all_coords = np.concatenate([xyz1[valid1].ravel(), xyz2[valid2].ravel()])
+    if all_coords.size:
+        max_abs = max(float(np.abs(all_coords).max()), 10.0)
     else:
         max_abs = 10.0
 
+    # The distance plot's y-limit does not change between frames
+    valid_d = node_distance[~np.isnan(node_distance)]
+    max_d = float(valid_d.max()) if valid_d.size else None
+
     ax3d.set_xlim(-max_abs, max_abs)
     ax3d.set_ylim(-max_abs, max_abs)
     ax3d.set_zlim(-max_abs, max_abs)
@@ -238,10 +188,8 @@ def main():
             # Node 1
             if p1 is not None:
                 ax3d.scatter([p1[0]], [p1[1]], [p1[2]], c="r", s=40, label="node1")
-                h1 = df1.loc[frame, "imu_heading_deg"]
-                pitch1 = df1.loc[frame, "imu_pitch_deg"]
-                v1 = orientation_vector_from_imu(h1, pitch1)
-                if v1 is not None:
+                if orient1_ok[frame]:
+                    v1 = orient1[frame]
                     ax3d.quiver(
                         p1[0], p1[1], p1[2],
                         v1[0], v1[1], v1[2],
@@ -253,10 +201,8 @@ def main():
             # Node 2
             if p2 is not None:
                 ax3d.scatter([p2[0]], [p2[1]], [p2[2]], c="b", s=40, label="node2")
-                h2 = df2.loc[frame, "imu_heading_deg"]
-                pitch2 = df2.loc[frame, "imu_pitch_deg"]
-                v2 = orientation_vector_from_imu(h2, pitch2)
-                if v2 is not None:
+                if orient2_ok[frame]:
+                    v2 = orient2[frame]
                     ax3d.quiver(
                         p2[0], p2[1], p2[2],
                         v2[0], v2[1], v2[2],
@@ -273,9 +219,7 @@ def main():
             dist_line.set_data(x_data, y_data)
             ax_dist.set_xlim(0, n)
 
-            valid_d = [d for d in node_distance if not np.isnan(d)]
-            if valid_d:
-                max_d = max(valid_d)
+            if max_d is not None:
                 ax_dist.set_ylim(0, max(max_d * 1.1, 10))
             else:
                 ax_dist.set_ylim(0, 10)
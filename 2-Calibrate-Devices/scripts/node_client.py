@@ -2,6 +2,7 @@
 
 import argparse
 import base64
+import io
 import json
 import socket
 import subprocess
@@ -14,6 +15,13 @@ import board
 import busio
 import adafruit_bno055
 
+try:
+    from picamera2 import Picamera2
+    HAS_PICAMERA2 = True
+except ImportError:
+    HAS_PICAMERA2 = False
+    Picamera2 = None
+
 # ---------- CONFIG ----------
 FRAME_INTERVAL = 1.0  # seconds between frames
 UWB_COMMAND = ["python", "-u", "nxp.py", "i", "100", "/dev/ttyUSB0"]
@@ -155,10 +163,39 @@ def uwb_worker():
     print("[UWB] Worker stopped")
 
 
-def capture_jpeg_bytes():
+def open_camera():
+    """
+    Start a persistent Picamera2 pipeline (configured once for the run).
+    Returns None if picamera2 is unavailable, so rpicam-still is run per frame.
+    """
+    if not HAS_PICAMERA2:
+        print("[CAM] picamera2 not available, falling back to rpicam-still per frame")
+        return None
+    try:
+        cam = Picamera2()
+        cam.configure(cam.create_still_configuration())
+        cam.start()
+        print("[CAM] Picamera2 started")
+        return cam
+    except Exception as e:
+        print("[CAM] Could not start Picamera2, falling back to rpicam-still:", e)
+        return None
+
+
+def capture_jpeg_bytes(cam=None):
     """
-    Capture a single JPEG frame from rpicam-still to stdout.
+    Capture a single JPEG frame: encoded in-process into memory by Picamera2 if
+    cam is given, otherwise from rpicam-still to stdout.
     """
+    if cam is not None:
+        buf = io.BytesIO()
+        try:
+            cam.capture_file(buf, format="jpeg")
+        except Exception as e:
+            print("[CAM] Capture error:", e)
+            return None
+        return buf.getvalue()
+
     try:
         proc = subprocess.run(
             ["rpicam-still", "-n", "-t", "1", "-o", "-"],
@@ -195,6 +232,9 @@ def main():
     # Start IMU
     imu_sensor = get_imu_sensor()
 
+    # Start camera once instead of launching rpicam-still for every frame
+    cam = open_camera()
+
     # Start UWB thread
     t_uwb = threading.Thread(target=uwb_worker, daemon=True)
     t_uwb.start()
@@ -204,7 +244,7 @@ def main():
             ts = datetime.now().isoformat(timespec="milliseconds")
 
             # 1) Capture image
-            jpeg_bytes = capture_jpeg_bytes()
+            jpeg_bytes = capture_jpeg_bytes(cam)
             if jpeg_bytes is None:
                 time.sleep(args.interval)
                 continue
@@ -238,6 +278,9 @@ def main():
         print("\n[MAIN] Ctrl+C, stopping...")
     finally:
         uwb_stop_event.set()
+        if cam is not None:
+            cam.stop()
+            cam.close()
         try:
             sock.close()
         except Exception:
@@ -5,7 +5,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D  # noqa: F401
 from matplotlib.animation import FuncAnimation
-import math
+
+from uwb_geometry import spherical_to_cartesian_arrays
 
 # -------- USER CONFIG --------
 REFERENCE_NODE = 2   # 1 or 2: which node's UWB you want to trust for geometry
@@ -17,18 +18,6 @@ PLAYBACK_SPEED = 1.0
 # -----------------------------
 
 
-def spherical_to_cartesian(dist_cm, az_deg, el_deg):
-    if np.isnan(dist_cm) or np.isnan(az_deg) or np.isnan(el_deg):
-        return np.nan, np.nan, np.nan
-    r = float(dist_cm)
-    az = math.radians(float(az_deg))
-    el = math.radians(float(el_deg))
-    x = r * math.cos(el) * math.cos(az)
-    y = r * math.cos(el) * math.sin(az)
-    z = r * math.sin(el)
-    return x, y, z
-
-
 def main():
     df1 = pd.read_csv(NODE1_CSV)
     df2 = pd.read_csv(NODE2_CSV)
@@ -68,15 +57,7 @@ def main():
         x_label = "frame index"
 
     # Cartesian coordinates from THIS node's point of view
-    xs, ys, zs = [], [], []
-    for d, a, e in zip(dist, az, el):
-        x, y, z = spherical_to_cartesian(d, a, e)
-        xs.append(x)
-        ys.append(y)
-        zs.append(z)
-    xs = np.array(xs)
-    ys = np.array(ys)
-    zs = np.array(zs)
+    xs, ys, zs = spherical_to_cartesian_arrays(dist, az, el)
 
     # ---- Matplotlib figure ----
     fig = plt.figure(figsize=(14, 8))
@@ -0,0 +1,88 @@
+"""
+UWB spherical -> Cartesian conversion shared by the calibration scripts.
+
+Convention: azimuth 0 = +X axis, CCW towards +Y; elevation 0 = XY plane, +Z up.
+A sample with any NaN input (distance, azimuth or elevation) converts to
+(NaN, NaN, NaN), so a partial UWB fix never yields a partial position.
+"""
+
+import math
+import numpy as np
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        # No-op stand-in so numba kernels can still be defined (as plain Python) without numba
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda f: f
+
+    prange = range
+
+
+def spherical_to_cartesian_np(dist_cm, az_deg, el_deg, dtype=np.float64):
+    """
+    Vectorized conversion of whole columns (array-likes of equal length).
+    Returns x, y, z arrays of the given dtype.
+    Each sin/cos is taken once and written back into the radian buffers.
+    """
+    r = np.asarray(dist_cm, dtype=dtype)
+    az = np.deg2rad(np.asarray(az_deg, dtype=dtype))
+    el = np.deg2rad(np.asarray(el_deg, dtype=dtype))
+    missing = np.isnan(r) | np.isnan(az) | np.isnan(el)
+
+    r_cos_el = np.cos(el)
+    r_cos_el *= r
+    z = np.sin(el, out=el)
+    z *= r
+    x = np.cos(az)
+    x *= r_cos_el
+    y = np.sin(az, out=az)
+    y *= r_cos_el
+
+    # z does not depend on azimuth, so blank it explicitly
+    z[missing] = np.nan
+    return x, y, z
+
+
+@njit(parallel=True, cache=True)
+def spherical_to_cartesian_batch(dist_cm, az_deg, el_deg, out_x, out_y, out_z):
+    """
+    numba version of spherical_to_cartesian_np, writing into the out_* arrays.
+    (fastmath is left off because it lets numba assume there are no NaNs.)
+    """
+    for i in prange(dist_cm.size):
+        r = dist_cm[i]
+        if math.isnan(r) or math.isnan(az_deg[i]) or math.isnan(el_deg[i]):
+            out_x[i] = np.nan
+            out_y[i] = np.nan
+            out_z[i] = np.nan
+            continue
+        az = math.radians(az_deg[i])
+        el = math.radians(el_deg[i])
+        r_cos_el = r * math.cos(el)
+        out_x[i] = r_cos_el * math.cos(az)
+        out_y[i] = r_cos_el * math.sin(az)
+        out_z[i] = r * math.sin(el)
+
+
+def spherical_to_cartesian_arrays(dist_cm, az_deg, el_deg):
+    """
+    Convert whole columns to float64 x, y, z arrays, with the numba kernel
+    when it is installed and plain NumPy otherwise.
+    """
+    if not HAS_NUMBA:
+        return spherical_to_cartesian_np(dist_cm, az_deg, el_deg)
+
+    d_arr = np.ascontiguousarray(dist_cm, dtype=np.float64)
+    a_arr = np.ascontiguousarray(az_deg, dtype=np.float64)
+    e_arr = np.ascontiguousarray(el_deg, dtype=np.float64)
+    xs = np.empty_like(d_arr)
+    ys = np.empty_like(d_arr)
+    zs = np.empty_like(d_arr)
+    spherical_to_cartesian_batch(d_arr, a_arr, e_arr, xs, ys, zs)
+    return xs, ys, zs